@@ -1,40 +1,118 @@
 import hashlib
+import hmac
+import os
+import secrets
+import threading
+from functools import lru_cache
+from typing import Dict, Optional
 
-# Predefined user accounts
-# In production, these would be stored in a proper database with proper hashing
+from sqlmodel import Session, select
+
+from .models import Account, engine
+
+# PBKDF2-SHA256 work factor for new password hashes, older hashes are upgraded at the next login
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "260000"))
+
+# Predefined user accounts (the demo credentials listed in the README), copied into
+# the Account table on startup with salted PBKDF2 hashes
 ACCOUNTS = {
     "admin": {
-        "password_hash": hashlib.sha256("admin123".encode()).hexdigest(),
+        "password": "admin123",
         "account_id": "admin"
     },
     "user1": {
-        "password_hash": hashlib.sha256("user123".encode()).hexdigest(),
+        "password": "user123",
         "account_id": "user1"
     },
     "user2": {
-        "password_hash": hashlib.sha256("user456".encode()).hexdigest(),
+        "password": "user456",
         "account_id": "user2"
     },
     "user3": {
-        "password_hash": hashlib.sha256("user789".encode()).hexdigest(),
+        "password": "user789",
         "account_id": "user3"
     },
     "demo": {
-        "password_hash": hashlib.sha256("demo123".encode()).hexdigest(),
+        "password": "demo123",
         "account_id": "demo"
     }
 }
 
-def verify_account(username: str, password: str) -> bool:
-    """Verify if username and password match"""
-    if username not in ACCOUNTS:
+# username -> account id, accounts are only read from the database once per process
+_account_ids: Dict[str, str] = {}
+_account_ids_lock = threading.Lock()
+
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """Salted PBKDF2-SHA256 hash in the "pbkdf2_sha256$<iterations>$<salt>$<digest>" format"""
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations).hex()
+    return f"pbkdf2_sha256${iterations}${salt}${digest}"
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    """Checked against unknown usernames so they take as long as a wrong password, built at the first such login"""
+    return hash_password(secrets.token_hex(16))
+
+def _check_password(password: str, password_hash: str) -> bool:
+    if not password_hash.startswith("pbkdf2_sha256$"):
         return False
-    
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
-    return ACCOUNTS[username]["password_hash"] == password_hash
+    _, iterations, salt, digest = password_hash.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), int(iterations)).hex()
+    return hmac.compare_digest(candidate, digest)
+
+def _needs_rehash(password_hash: str) -> bool:
+    if not password_hash.startswith("pbkdf2_sha256$"):
+        return True
+    return int(password_hash.split("$")[1]) < PASSWORD_HASH_ITERATIONS
+
+def seed_accounts():
+    """
+    Insert the predefined accounts that are not in the Account table yet, and
+    rehash seeded accounts still stored with the unsalted SHA-256 of older versions
+    """
+    with Session(engine) as session:
+        existing = {account.username: account for account in session.exec(select(Account)).all()}
+        for username, seed in ACCOUNTS.items():
+            account = existing.get(username)
+            if account is None:
+                session.add(Account(
+                    username=username,
+                    account_id=seed["account_id"],
+                    password_hash=hash_password(seed["password"])
+                ))
+            elif account.password_hash == hashlib.sha256(seed["password"].encode()).hexdigest():
+                account.password_hash = hash_password(seed["password"])
+                session.add(account)
+        session.commit()
+
+def verify_account(username: str, password: str) -> Optional[str]:
+    """
+    Check a username and password against the Account table. Deliberately slow,
+    only called at login; run it off the event loop.
+    :return: The account id, or None if the credentials do not match
+    """
+    with Session(engine) as session:
+        account = session.get(Account, username)
+        if account is None:
+            _check_password(password, _dummy_hash())
+            return None
+        if not _check_password(password, account.password_hash):
+            return None
+        if _needs_rehash(account.password_hash):
+            account.password_hash = hash_password(password)
+            session.add(account)
+            session.commit()
+        return account.account_id
 
-def get_account_id(username: str) -> str:
+def get_account_id(username: str) -> Optional[str]:
     """Get account ID for username"""
-    if username in ACCOUNTS:
-        return ACCOUNTS[username]["account_id"]
-    return None 
\ No newline at end of file
+    account_id = _account_ids.get(username)
+    if account_id is not None:
+        return account_id
+    with Session(engine) as session:
+        account = session.get(Account, username)
+    if account is None:
+        return None
+    with _account_ids_lock:
+        _account_ids[username] = account.account_id
+    return account.account_id
@@ -0,0 +1,311 @@
+import json
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, SQLModel, select, func
+
+from .models import RequestLog, FeedbackLog, UsageRollup, engine
+from .labeling import AUTO_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0]
+
+BACKFILL_CHUNK_SIZE = 5000
+
+RollupKey = Tuple[datetime, str, str, str]
+
+# UsageRollup counters that are added up by the upsert, see _merge
+_COUNTER_COLUMNS = (
+    "requests", "errors", "cache_hits", "escalations", "prompt_tokens", "completion_tokens",
+    "latency_sum", "feedback", "feedback_supported", "feedback_corrected",
+)
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class _Counters:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.escalations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_sum = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.feedback = 0
+        self.feedback_supported = 0
+        self.feedback_corrected = 0
+
+    def add_request(self, request_log: RequestLog):
+        self.requests += 1
+        if request_log.predicted_label is None:
+            self.errors += 1
+        if request_log.cache_hit:
+            self.cache_hits += 1
+        if request_log.escalated:
+            self.escalations += 1
+        self.prompt_tokens += request_log.prompt_tokens or 0
+        self.completion_tokens += request_log.completion_tokens or 0
+        if request_log.processing_time is not None:
+            self.latency_sum += request_log.processing_time
+            self.histogram[bisect_left(LATENCY_BUCKETS, request_log.processing_time)] += 1
+
+    def add_feedback(self, feedback_log: FeedbackLog):
+        self.feedback += 1
+        if feedback_log.is_supported:
+            self.feedback_supported += 1
+        if feedback_log.corrected_label:
+            self.feedback_corrected += 1
+
+
+def _request_key(request_log: RequestLog) -> RollupKey:
+    return (hour_bucket(request_log.timestamp), request_log.account_id,
+            request_log.model_name, request_log.predicted_label or "")
+
+
+def _feedback_key(feedback_log: FeedbackLog, request_log: RequestLog) -> RollupKey:
+    # Feedback is counted under the model and label of the request it rates
+    return (hour_bucket(feedback_log.timestamp), feedback_log.account_id,
+            request_log.model_name, request_log.predicted_label or "")
+
+
+def commit_with_rollups(session: Session, rows: Iterable[SQLModel]):
+    """
+    Add newly inserted RequestLog/FeedbackLog rows to the hourly rollups and
+    commit, so the counters always match the committed rows
+    """
+    counters: Dict[RollupKey, _Counters] = defaultdict(_Counters)
+    for row in rows:
+        if isinstance(row, RequestLog):
+            counters[_request_key(row)].add_request(row)
+        elif isinstance(row, FeedbackLog):
+            request_log = session.get(RequestLog, row.request_id)
+            if request_log is not None:
+                counters[_feedback_key(row, request_log)].add_feedback(row)
+    _merge(session, counters)
+    session.commit()
+
+
+def _upsert(key: RollupKey, delta: _Counters):
+    """INSERT of the delta that adds it to the existing row instead when the key is taken"""
+    dialect = sqlite if engine.dialect.name == "sqlite" else postgresql
+    bucket_start, account_id, model_name, label = key
+    statement = dialect.insert(UsageRollup).values(
+        bucket_start=bucket_start, account_id=account_id, model_name=model_name, label=label,
+        latency_histogram="[]",
+        **{name: getattr(delta, name) for name in _COUNTER_COLUMNS}
+    )
+    table = UsageRollup.__table__
+    return statement.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={name: func.coalesce(table.c[name], 0) + statement.excluded[name] for name in _COUNTER_COLUMNS}
+    )
+
+
+def _merge(session: Session, counters: Dict[RollupKey, _Counters]):
+    # The upsert is atomic across processes, two writers creating the same row cannot both insert it
+    table = UsageRollup.__table__
+    for key, delta in counters.items():
+        session.exec(_upsert(key, delta))
+        if not any(delta.histogram):
+            continue
+        # The upsert holds the row (Postgres) or database (SQLite) write lock until commit,
+        # so the histogram JSON can be read and written back without losing updates
+        where = (
+            (table.c.bucket_start == key[0]) & (table.c.account_id == key[1])
+            & (table.c.model_name == key[2]) & (table.c.label == key[3])
+        )
+        stored = session.exec(select(table.c.latency_histogram).where(where)).one()
+        histogram = json.loads(stored or "[]") or [0] * len(delta.histogram)
+        session.exec(update(table).where(where).values(
+            latency_histogram=json.dumps([a + b for a, b in zip(histogram, delta.histogram)])
+        ))
+
+
+def backfill_rollups():
+    """Build the rollups from existing logs when the table is new, e.g. after upgrading an old logs.db"""
+    with Session(engine) as session:
+        if session.exec(select(UsageRollup.bucket_start).limit(1)).first() is not None:
+            return
+        if session.exec(select(RequestLog.id).limit(1)).first() is None:
+            return
+        logger.info("Backfilling usage rollups from existing logs")
+        counters: Dict[RollupKey, _Counters] = defaultdict(_Counters)
+
+        # Keyset pagination keeps memory flat and each chunk cheap on large tables
+        last_id = 0
+        while True:
+            request_logs = session.exec(
+                select(RequestLog).where(RequestLog.id > last_id).order_by(RequestLog.id).limit(BACKFILL_CHUNK_SIZE)
+            ).all()
+            if not request_logs:
+                break
+            for request_log in request_logs:
+                counters[_request_key(request_log)].add_request(request_log)
+            last_id = request_logs[-1].id
+            session.expunge_all()
+
+        last_id = 0
+        while True:
+            rows = session.exec(
+                select(FeedbackLog, RequestLog)
+                .join(RequestLog, FeedbackLog.request_id == RequestLog.id)
+                .where(FeedbackLog.id > last_id)
+                .order_by(FeedbackLog.id)
+                .limit(BACKFILL_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                break
+            for feedback_log, request_log in rows:
+                counters[_feedback_key(feedback_log, request_log)].add_feedback(feedback_log)
+            last_id = rows[-1][0].id
+            session.expunge_all()
+
+        _merge(session, counters)
+        session.commit()
+
+
+def _percentile(histogram: List[int], fraction: float) -> Optional[float]:
+    """Upper bound of the histogram bucket holding the given fraction of calls"""
+    total = sum(histogram)
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= target:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+    return None
+
+
+class _Aggregate(_Counters):
+    def __init__(self):
+        super().__init__()
+        self.labels: Dict[str, int] = defaultdict(int)
+
+    def add(self, rollup: UsageRollup):
+        self.requests += rollup.requests
+        self.errors += rollup.errors
+        self.cache_hits += rollup.cache_hits
+        self.escalations += rollup.escalations
+        self.prompt_tokens += rollup.prompt_tokens
+        self.completion_tokens += rollup.completion_tokens
+        self.latency_sum += rollup.latency_sum
+        for i, count in enumerate(json.loads(rollup.latency_histogram)):
+            self.histogram[i] += count
+        self.feedback += rollup.feedback
+        self.feedback_supported += rollup.feedback_supported
+        self.feedback_corrected += rollup.feedback_corrected
+        if rollup.label and rollup.requests:
+            self.labels[rollup.label] += rollup.requests
+
+    def to_dict(self) -> dict:
+        timed = sum(self.histogram)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "cache_hits": self.cache_hits,
+            "escalations": self.escalations,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_latency": self.latency_sum / timed if timed else None,
+            "p50_latency": _percentile(self.histogram, 0.5),
+            "p90_latency": _percentile(self.histogram, 0.9),
+            "p99_latency": _percentile(self.histogram, 0.99),
+            "feedback": self.feedback,
+            "feedback_supported": self.feedback_supported,
+            "feedback_corrected": self.feedback_corrected,
+            "agreement_rate": self.feedback_supported / self.feedback if self.feedback else None,
+            "label_distribution": dict(sorted(self.labels.items(), key=lambda item: -item[1]))
+        }
+
+
+def query_analytics(session: Session, granularity: str = "hour", start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, account_id: Optional[str] = None,
+                    model_name: Optional[str] = None) -> dict:
+    """
+    Time-bucketed stats read from the rollups, cost depends on the number of
+    buckets in the range rather than on the number of logged requests.
+    Latency percentiles are histogram bucket upper bounds (see LATENCY_BUCKETS).
+    """
+    query = select(UsageRollup)
+    if start is not None:
+        query = query.where(UsageRollup.bucket_start >= hour_bucket(start))
+    if end is not None:
+        query = query.where(UsageRollup.bucket_start <= end)
+    if account_id:
+        query = query.where(UsageRollup.account_id == account_id)
+    if model_name:
+        query = query.where(UsageRollup.model_name == model_name)
+
+    buckets: Dict[datetime, _Aggregate] = defaultdict(_Aggregate)
+    models: Dict[str, _Aggregate] = defaultdict(_Aggregate)
+    total = _Aggregate()
+    for rollup in session.exec(query.order_by(UsageRollup.bucket_start)):
+        bucket_start = rollup.bucket_start
+        if granularity == "day":
+            bucket_start = bucket_start.replace(hour=0)
+        buckets[bucket_start].add(rollup)
+        models[rollup.model_name].add(rollup)
+        total.add(rollup)
+
+    return {
+        "granularity": granularity,
+        "latency_buckets": LATENCY_BUCKETS,
+        "total": total.to_dict(),
+        "by_model": {name: aggregate.to_dict() for name, aggregate in models.items()},
+        "buckets": [
+            {"bucket_start": bucket_start, **aggregate.to_dict()}
+            for bucket_start, aggregate in buckets.items()
+        ]
+    }
+
+
+def request_totals(session: Session) -> Tuple[int, int]:
+    """Logged requests and cache hits over the whole history, from the rollups"""
+    requests, cache_hits = session.exec(
+        select(func.sum(UsageRollup.requests), func.sum(UsageRollup.cache_hits))
+    ).one()
+    return requests or 0, cache_hits or 0
+
+
+def logs_summary(session: Session) -> dict:
+    """Request and feedback counts per account and model_name "auto" routing stats, from the rollups"""
+    rows = session.exec(
+        select(UsageRollup.account_id, func.sum(UsageRollup.requests), func.sum(UsageRollup.feedback))
+        .group_by(UsageRollup.account_id)
+    ).all()
+    auto_requests, escalations, auto_feedback, auto_supported = session.exec(
+        select(func.sum(UsageRollup.requests), func.sum(UsageRollup.escalations),
+               func.sum(UsageRollup.feedback), func.sum(UsageRollup.feedback_supported))
+        .where(UsageRollup.model_name == AUTO_MODEL)
+    ).one()
+    auto_requests, escalations = auto_requests or 0, escalations or 0
+    return {
+        "total_requests": sum(requests for _, requests, _ in rows),
+        "total_feedback": sum(feedback for _, _, feedback in rows),
+        "requests_by_account": [
+            {"account_id": account_id, "count": requests} for account_id, requests, _ in rows if requests
+        ],
+        "feedback_by_account": [
+            {"account_id": account_id, "count": feedback} for account_id, _, feedback in rows if feedback
+        ],
+        "routing": {
+            "auto_requests": auto_requests,
+            "escalations": escalations,
+            "escalation_rate": escalations / auto_requests if auto_requests else 0.0,
+            "agreement_rate": auto_supported / auto_feedback if auto_feedback else None
+        }
+    }
@@ -0,0 +1,238 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional, Set
+
+from sqlmodel import Session
+
+from .models import RequestLog, engine
+from .labeling import label_texts
+from .cache import prediction_cache
+from .log_writer import request_ids
+from .analytics import commit_with_rollups
+from .metrics import LABEL_RESULTS, label_outcome
+
+# Batch labeling settings
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "5000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "10"))
+# Shared by all batch requests and jobs of the process, interactive /label keeps the remaining workers
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "2"))
+BATCH_RATE_LIMIT_RPM = int(os.getenv("BATCH_RATE_LIMIT_RPM", "0"))  # rows per minute, 0 = unlimited
+
+
+class BatchInputError(ValueError):
+    """Raised when an uploaded batch file cannot be parsed"""
+
+
+def parse_batch_file(filename: str, content: bytes) -> List[str]:
+    """
+    Read texts from an uploaded CSV or JSONL file.
+    CSV files must have a 'text' column (otherwise the first column is used);
+    JSONL lines may be objects with a 'text' key or plain JSON strings.
+    """
+    try:
+        data = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BatchInputError("File must be UTF-8 encoded")
+
+    texts = []
+    name = (filename or "").lower()
+    if name.endswith(".jsonl") or name.endswith(".ndjson"):
+        for line_number, line in enumerate(data.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                raise BatchInputError(f"Invalid JSON on line {line_number}")
+            text = row.get("text") if isinstance(row, dict) else row
+            if not isinstance(text, str):
+                raise BatchInputError(f"Line {line_number} has no 'text' string")
+            texts.append(text)
+    elif name.endswith(".csv"):
+        reader = csv.reader(io.StringIO(data))
+        header = next(reader, None)
+        if header is None:
+            return []
+        column = header.index("text") if "text" in header else 0
+        for row in reader:
+            if len(row) > column:
+                texts.append(row[column])
+    else:
+        raise BatchInputError("Only .csv and .jsonl files are supported")
+
+    return [text for text in texts if text.strip()]
+
+
+class _RatePacer:
+    """Spaces chunk starts so that no more than rows_per_minute rows are sent per minute"""
+
+    def __init__(self, rows_per_minute: int):
+        self.interval = 60.0 / rows_per_minute if rows_per_minute > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self, rows: int):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + rows * self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _ChunkLimiter:
+    """
+    Process-wide limit on batch and job chunks being labeled and on the rows
+    they send per minute. Waiting chunks get slots in arrival order, so
+    concurrent batches and jobs take turns.
+    """
+
+    def __init__(self, concurrency: int = BATCH_CONCURRENCY, rows_per_minute: int = BATCH_RATE_LIMIT_RPM):
+        self.concurrency = max(1, concurrency)
+        self.rows_per_minute = rows_per_minute
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pacer: Optional[_RatePacer] = None
+
+    @asynccontextmanager
+    async def slot(self, rows: int):
+        """Hold one of the chunk slots, entered once the chunk's rows fit the rate limit"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Created on the loop that uses them
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._pacer = _RatePacer(self.rows_per_minute)
+        async with self._slots:
+            await self._pacer.wait(rows)
+            yield
+
+
+chunk_limiter = _ChunkLimiter()
+
+
+def _write_logs(request_logs: List[RequestLog], rows: List[dict],
+                on_chunk: Optional[Callable[[Session, List[dict]], None]] = None):
+    """Insert RequestLog rows in one transaction and fill in their ids"""
+    # Ids come from the same allocator as /label so they never collide with buffered rows
+    for request_log, row in zip(request_logs, rows):
+        request_log.id = row["id"] = request_ids.next_id()
+    with Session(engine) as session:
+        session.add_all(request_logs)
+        if on_chunk is not None:
+            on_chunk(session, rows)
+        commit_with_rollups(session, request_logs)
+
+
+async def label_chunks(texts: List[str], model_name: str, account_id: str,
+                       chunk_size: int = BATCH_CHUNK_SIZE,
+                       on_chunk: Optional[Callable[[Session, List[dict]], None]] = None) -> AsyncIterator[List[dict]]:
+    """
+    Label texts in multi-row chunks within the process-wide chunk_limiter,
+    and yield the rows of each chunk as soon as it completes.
+    Cached rows are yielded first. The RequestLog rows of a chunk are written in
+    one transaction, off the event loop, together with whatever on_chunk(session, rows)
+    adds to it; on_chunk runs in that worker thread.
+    """
+
+    async def persist(indices, outcomes, processing_time, cache_hit):
+        request_logs = []
+        rows = []
+        for i, (label, error_message) in zip(indices, outcomes):
+            request_logs.append(RequestLog(
+                account_id=account_id,
+                model_name=model_name,
+                input_text=texts[i],
+                predicted_label=label,
+                error_message=error_message,
+                processing_time=processing_time,
+                cache_hit=cache_hit
+            ))
+            LABEL_RESULTS.labels("batch", model_name, label_outcome(label, cache_hit)).inc()
+            rows.append({
+                "index": i,
+                "id": None,
+                "input_text": texts[i],
+                "predicted_label": label,
+                "error_message": error_message,
+                "processing_time": processing_time,
+                "cache_hit": cache_hit
+            })
+        await asyncio.to_thread(_write_logs, request_logs, rows, on_chunk)
+        return rows
+
+    # Serve cached rows straight away
+    pending = []
+    cached_indices, cached_outcomes = [], []
+    start_time = time.time()
+    for i, text in enumerate(texts):
+        cached_label = prediction_cache.get(text, model_name)
+        if cached_label is not None:
+            cached_indices.append(i)
+            cached_outcomes.append((cached_label, None))
+        else:
+            pending.append(i)
+    if cached_indices:
+        yield await persist(cached_indices, cached_outcomes, time.time() - start_time, True)
+
+    async def run_chunk(indices: List[int]):
+        async with chunk_limiter.slot(len(indices)):
+            outcomes, processing_time = await label_texts([texts[i] for i in indices], model_name)
+            return indices, outcomes, processing_time
+
+    # Chunks are started as earlier ones finish, a run never has more tasks than there are slots
+    chunk_size = max(1, chunk_size)
+    chunks = iter(range(0, len(pending), chunk_size))
+    running: Set[asyncio.Task] = set()
+
+    def start_next_chunk():
+        start = next(chunks, None)
+        if start is not None:
+            running.add(asyncio.create_task(run_chunk(pending[start:start + chunk_size])))
+
+    for _ in range(chunk_limiter.concurrency):
+        start_next_chunk()
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                running.discard(task)
+                start_next_chunk()
+                indices, outcomes, processing_time = task.result()
+                for i, (label, _) in zip(indices, outcomes):
+                    if label is not None:
+                        prediction_cache.put(texts[i], model_name, label)
+                yield await persist(indices, outcomes, processing_time, False)
+    finally:
+        # Stop outstanding chunks if the consumer went away
+        for task in running:
+            task.cancel()
+
+
+async def label_batch(texts: List[str], model_name: str, account_id: str) -> AsyncIterator[dict]:
+    """Label texts with label_chunks, yielding one result per row and a final summary"""
+    summary = {"total": len(texts), "labeled": 0, "failed": 0, "cache_hits": 0}
+    async for rows in label_chunks(texts, model_name, account_id):
+        for row in rows:
+            summary["labeled" if row["predicted_label"] is not None else "failed"] += 1
+            if row["cache_hit"]:
+                summary["cache_hits"] += 1
+            yield row
+    yield {"event": "summary", **summary}
+
+
+async def stream_batch(rows: AsyncIterator[dict], stream_format: str = "ndjson") -> AsyncIterator[str]:
+    """Serialize batch results as NDJSON lines or Server-Sent Events"""
+    async for row in rows:
+        if stream_format == "sse":
+            event = "summary" if row.get("event") == "summary" else "result"
+            yield f"event: {event}\ndata: {json.dumps(row)}\n\n"
+        else:
+            yield json.dumps(row) + "\n"
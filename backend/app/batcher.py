@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .metrics import current_timings, use_timings, reset_timings, current_usage, use_usage, reset_usage
+from .scheduler import LABEL_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching settings, off by default
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "false").lower() == "true"
+MICROBATCH_WINDOW_MS = float(os.getenv("MICROBATCH_WINDOW_MS", "30"))
+# Requests come from the scheduler's workers, one each, so a batch never holds more than LABEL_WORKERS
+MICROBATCH_MAX_ITEMS = int(os.getenv("MICROBATCH_MAX_ITEMS", str(LABEL_WORKERS)))
+
+Outcome = Tuple[Optional[str], Optional[str]]
+_Item = Tuple[str, asyncio.Future, Optional[Dict[str, float]], Optional[Dict[str, int]]]
+BatchHandler = Callable[[str, List[str]], Awaitable[List[Outcome]]]
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-text requests for the same model and hands them
+    to the handler as one list, once the window has passed since the first
+    request or max_items requests are waiting, whichever comes first.
+
+    At most max_waiting callers (the scheduler's workers) can wait at a time;
+    once all of them are waiting no other request can arrive, so every pending
+    batch is sent without waiting out the window.
+    """
+
+    def __init__(self, handler: BatchHandler, window_ms: float = MICROBATCH_WINDOW_MS,
+                 max_items: int = MICROBATCH_MAX_ITEMS, enabled: bool = MICROBATCH_ENABLED,
+                 max_waiting: int = LABEL_WORKERS):
+        self.handler = handler
+        self.window = window_ms / 1000.0
+        self.max_items = max(1, max_items)
+        self.max_waiting = max(1, max_waiting)
+        self.enabled = enabled
+        # model name -> waiting (text, future, caller's stage timings, caller's token usage)
+        self._pending: Dict[str, List[_Item]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+
+    async def label(self, text: str, model_name: str) -> Tuple[Optional[str], Optional[str], float]:
+        """
+        Label one text as part of the next batch for its model
+        :return: Tuple of (predicted_label, error_message, processing_time)
+        """
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiting = self._pending.setdefault(model_name, [])
+        waiting.append((text, future, current_timings(), current_usage()))
+        if len(waiting) >= self.max_items:
+            self._flush(model_name)
+        elif sum(len(items) for items in self._pending.values()) >= self.max_waiting:
+            for pending_model in list(self._pending):
+                self._flush(pending_model)
+        elif model_name not in self._timers:
+            self._timers[model_name] = loop.call_later(self.window, self._flush, model_name)
+
+        predicted_label, error_message = await future
+        return predicted_label, error_message, time.time() - start_time
+
+    def _flush(self, model_name: str):
+        timer = self._timers.pop(model_name, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(model_name, [])
+        if not items:
+            return
+        task = asyncio.create_task(self._run(model_name, items))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, model_name: str, items: List[_Item]):
+        self.batches += 1
+        self.items += len(items)
+        # The batch's stages are timed once and reported to every caller in it,
+        # its token usage is split evenly between them
+        batch_timings: Dict[str, float] = {}
+        batch_usage: Dict[str, int] = {}
+        token = use_timings(batch_timings)
+        usage_token = use_usage(batch_usage)
+        try:
+            outcomes = await self.handler(model_name, [text for text, _, _, _ in items])
+        except Exception as e:
+            logger.exception(f"Micro-batch of {len(items)} {model_name} texts failed")
+            outcomes = [(None, f"Labeling error: {str(e)}")] * len(items)
+        finally:
+            reset_usage(usage_token)
+            reset_timings(token)
+        for (_, future, timings, usage), outcome in zip(items, outcomes):
+            if timings is not None:
+                for stage_name, seconds in batch_timings.items():
+                    timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+            if usage is not None:
+                for kind, count in batch_usage.items():
+                    usage[kind] = usage.get(kind, 0) + round(count / len(items))
+            # The caller may have gone away while the batch was running
+            if not future.done():
+                future.set_result(outcome)
+
+    def stats(self) -> dict:
+        """Batch counts since process start"""
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_items": self.max_items,
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": self.items / self.batches if self.batches else 0.0
+        }
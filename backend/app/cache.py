@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select, delete, update
+
+from .models import PredictionCache, engine
+from .labeling import normalize_text, taxonomy_version
+
+logger = logging.getLogger(__name__)
+
+# Prediction cache settings
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000"))
+PREDICTION_CACHE_TTL_SECONDS = int(os.getenv("PREDICTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))  # 0 = never expire
+# How often new entries, hit counts and evictions are written to the PredictionCache table
+PREDICTION_CACHE_FLUSH_INTERVAL_SECONDS = float(os.getenv("PREDICTION_CACHE_FLUSH_INTERVAL_SECONDS", "5"))
+
+
+def cache_key(text: str, model_name: str, version: Optional[str] = None) -> str:
+    """Exact-match key over the normalized text, the model and the taxonomy version"""
+    version = version or taxonomy_version()
+    payload = f"{version}\x00{model_name}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class PredictionCacheStore:
+    """
+    LRU/TTL cache of predicted labels, persisted in the PredictionCache table.
+
+    Lookups and inserts only touch an in-memory index loaded at startup. New
+    entries, hit counts and evictions are collected in memory and written to the
+    table from a worker thread every flush interval, so the cache and its LRU
+    order survive restarts without a query on the request path. Entries from the
+    last interval are lost on a crash.
+    """
+
+    def __init__(self, max_entries: int = PREDICTION_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = PREDICTION_CACHE_TTL_SECONDS, enabled: bool = PREDICTION_CACHE_ENABLED,
+                 flush_interval: float = PREDICTION_CACHE_FLUSH_INTERVAL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.flush_interval = max(0.1, flush_interval)
+        # cache_key -> (predicted_label, created_at timestamp), least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # Not yet written to the table: new rows, cache_key -> (hits, last access), removed keys
+        self._pending_puts: Dict[str, dict] = {}
+        self._pending_hits: Dict[str, Tuple[int, datetime]] = {}
+        self._pending_deletes: Set[str] = set()
+        # Guards the in-memory state only, never held during database I/O
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        """Start the periodic flush task"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush task and write what is still pending"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self._flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            # The entries stay in memory, only their persistence is lost
+            logger.warning(f"Flushing the prediction cache failed: {e}")
+
+    def load(self):
+        """Load live entries from the database, dropping expired and stale-taxonomy rows"""
+        if not self.enabled:
+            return
+        version = taxonomy_version()
+        with Session(engine) as session:
+            session.exec(delete(PredictionCache).where(PredictionCache.taxonomy_version != version))
+            if self.ttl_seconds:
+                cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+                session.exec(delete(PredictionCache).where(PredictionCache.created_at < cutoff))
+            session.commit()
+            rows = session.exec(select(PredictionCache).order_by(PredictionCache.last_accessed)).all()
+
+        with self._lock:
+            self._entries.clear()
+            for row in rows:
+                self._entries[row.cache_key] = (row.predicted_label, row.created_at.timestamp())
+            # Entries put since the last flush are not in the table yet
+            for key, row in self._pending_puts.items():
+                self._entries[key] = (row["predicted_label"], row["created_at"].timestamp())
+            self._evict()
+
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - created_at > self.ttl_seconds
+
+    def get(self, text: str, model_name: str) -> Optional[str]:
+        """Get the cached label for text, or None on a miss"""
+        if not self.enabled:
+            return None
+        key = cache_key(text, model_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1]):
+                self.misses += 1
+                if entry is not None:
+                    del self._entries[key]
+                    self._remove_pending(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            count, _ = self._pending_hits.get(key, (0, None))
+            self._pending_hits[key] = (count + 1, datetime.utcnow())
+        return entry[0]
+
+    def put(self, text: str, model_name: str, predicted_label: str):
+        """Store a successful prediction"""
+        if not self.enabled:
+            return
+        version = taxonomy_version()
+        key = cache_key(text, model_name, version)
+        now = datetime.utcnow()
+        with self._lock:
+            self._entries[key] = (predicted_label, now.timestamp())
+            self._entries.move_to_end(key)
+            self._pending_deletes.discard(key)
+            self._pending_hits.pop(key, None)
+            self._pending_puts[key] = {
+                "cache_key": key,
+                "model_name": model_name,
+                "taxonomy_version": version,
+                "input_text": normalize_text(text),
+                "predicted_label": predicted_label,
+                "created_at": now,
+                "last_accessed": now,
+                "hit_count": 0
+            }
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            self._remove_pending(key)
+
+    def _remove_pending(self, key: str):
+        # Called with the lock held
+        self._pending_puts.pop(key, None)
+        self._pending_hits.pop(key, None)
+        self._pending_deletes.add(key)
+
+    def flush(self):
+        """Write pending entries, hit counts and removals to the table; blocking, run it off the event loop"""
+        with self._lock:
+            puts, self._pending_puts = self._pending_puts, {}
+            hits, self._pending_hits = self._pending_hits, {}
+            deletes, self._pending_deletes = self._pending_deletes, set()
+        if not (puts or hits or deletes):
+            return
+
+        with Session(engine) as session:
+            if deletes:
+                session.exec(delete(PredictionCache).where(PredictionCache.cache_key.in_(deletes)))
+            if puts:
+                dialect = sqlite if engine.dialect.name == "sqlite" else postgresql
+                statement = dialect.insert(PredictionCache)
+                session.exec(statement.on_conflict_do_update(
+                    index_elements=["cache_key"],
+                    set_={name: statement.excluded[name] for name in next(iter(puts.values())) if name != "cache_key"}
+                ), params=list(puts.values()))
+            for key, (count, last_accessed) in hits.items():
+                session.exec(
+                    update(PredictionCache)
+                    .where(PredictionCache.cache_key == key)
+                    .values(hit_count=PredictionCache.hit_count + count, last_accessed=last_accessed)
+                )
+            session.commit()
+
+    def invalidate(self, model_name: Optional[str] = None) -> int:
+        """
+        Remove all entries, or only those of one model; returns the number removed.
+        Blocking, run it off the event loop.
+        """
+        self.flush()
+        with Session(engine) as session:
+            query = delete(PredictionCache)
+            if model_name:
+                query = query.where(PredictionCache.model_name == model_name)
+            removed = session.exec(query).rowcount
+            session.commit()
+        # Keys are hashes, so reload the surviving entries instead of filtering in memory
+        self.load()
+        return removed
+
+    def stats(self) -> dict:
+        """Hit-rate and size statistics since process start"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "taxonomy_version": taxonomy_version(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_writes": len(self._pending_puts) + len(self._pending_hits) + len(self._pending_deletes),
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+prediction_cache = PredictionCacheStore()
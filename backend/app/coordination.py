@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import socket
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import delete, func, insert, literal, select, text, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from .models import WorkerProcess, WorkerLease, IdSequence, RequestLog, engine
+from .metrics import stage
+
+try:
+    import fcntl
+except ImportError:  # Windows, single-process development only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# "local" coordinates within this process only; "database" shares the OpenAI
+# concurrency cap, request ids and /status between every process using DATABASE_URL
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "local").lower()
+# In-flight OpenAI calls allowed across all processes, 0 = no global cap
+LABEL_GLOBAL_CONCURRENCY = int(os.getenv("LABEL_GLOBAL_CONCURRENCY", "0"))
+COORDINATION_HEARTBEAT_SECONDS = float(os.getenv("COORDINATION_HEARTBEAT_SECONDS", "1"))
+
+# A process missing this many heartbeats is considered dead and its leases are ignored
+STALE_HEARTBEATS = 5
+# Leases older than this are ignored even if their process is alive (e.g. a failed release)
+LEASE_MAX_SECONDS = 600
+# pg_advisory_xact_lock keys that serialize lease acquisition and startup on Postgres
+_ADVISORY_LOCK_KEY = 0x6C6162656C
+_STARTUP_LOCK_KEY = _ADVISORY_LOCK_KEY + 1
+
+
+@contextmanager
+def startup_lock():
+    """Serialize schema creation, seeding and backfills between processes starting at the same time"""
+    database = engine.url.database
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _STARTUP_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _STARTUP_LOCK_KEY})
+    elif engine.dialect.name == "sqlite" and database and database != ":memory:" and fcntl is not None:
+        with open(f"{database}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+def aggregate_status(statuses: List[dict], global_in_flight: int, global_concurrency: int) -> dict:
+    """Combine the scheduler status of several processes into one /status response"""
+    active_workers = sum(status["active_workers"] for status in statuses)
+    max_workers = sum(status["max_workers"] for status in statuses)
+    return {
+        "is_busy": active_workers >= max_workers or 0 < global_concurrency <= global_in_flight,
+        "queue_depth": sum(status["queue_depth"] for status in statuses),
+        "queue_capacity": sum(status["queue_capacity"] for status in statuses),
+        "active_workers": active_workers,
+        "max_workers": max_workers,
+        "in_flight_users": sorted({user for status in statuses for user in status["in_flight_users"]}),
+        "processing_time": max((status["processing_time"] for status in statuses), default=0),
+        "processes": len(statuses),
+        "global_in_flight": global_in_flight,
+        "global_concurrency": global_concurrency
+    }
+
+
+class LocalCoordinator:
+    """
+    Coordination inside a single process: the global cap is an asyncio semaphore
+    and the cluster status is this process's scheduler status.
+    """
+
+    def __init__(self, max_concurrency: int = LABEL_GLOBAL_CONCURRENCY):
+        self.max_concurrency = max(0, max_concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._status_provider: Callable[[], dict] = lambda: {}
+        self.in_flight = 0
+
+    async def start(self, status_provider: Callable[[], dict]):
+        """Start coordinating; status_provider returns this process's scheduler status"""
+        self._status_provider = status_provider
+        if self.max_concurrency:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def stop(self):
+        pass
+
+    async def acquire(self, model_name: str) -> Optional[str]:
+        """Wait for a slot under the global concurrency cap, returns a lease for release()"""
+        if self._semaphore is not None:
+            with stage("global_slot_wait"):
+                await self._semaphore.acquire()
+        self.in_flight += 1
+        return "local"
+
+    async def release(self, lease: Optional[str]):
+        if lease is None:
+            return
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def cluster_status(self) -> dict:
+        return aggregate_status([self._status_provider()], self.in_flight, self.max_concurrency)
+
+
+class DatabaseCoordinator(LocalCoordinator):
+    """
+    Coordination between processes through the application database (SQLite file
+    or Postgres). Each process heartbeats its scheduler status into WorkerProcess,
+    and every in-flight OpenAI call holds a WorkerLease row; a lease is only
+    inserted while fewer than max_concurrency leases of live processes exist.
+    """
+
+    def __init__(self, max_concurrency: int = LABEL_GLOBAL_CONCURRENCY,
+                 heartbeat_seconds: float = COORDINATION_HEARTBEAT_SECONDS):
+        super().__init__(max_concurrency)
+        self.heartbeat_seconds = max(0.1, heartbeat_seconds)
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._task: Optional[asyncio.Task] = None
+
+    def _live_after(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.heartbeat_seconds * STALE_HEARTBEATS)
+
+    async def start(self, status_provider: Callable[[], dict]):
+        self._status_provider = status_provider
+        if engine.dialect.name == "sqlite":
+            await asyncio.to_thread(sync_id_sequence, "requestlog")
+        await asyncio.to_thread(self._heartbeat)
+        self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.to_thread(self._remove_process)
+        except Exception as e:
+            logger.warning(f"Could not unregister process {self.process_id}: {e}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await asyncio.to_thread(self._heartbeat)
+            except Exception as e:
+                logger.warning(f"Coordination heartbeat failed: {e}")
+
+    def _heartbeat(self):
+        now = datetime.utcnow()
+        values = {"status": json.dumps(self._status_provider()), "heartbeat_at": now}
+        with engine.begin() as conn:
+            updated = conn.execute(
+                update(WorkerProcess).where(WorkerProcess.process_id == self.process_id).values(**values)
+            ).rowcount
+            if not updated:
+                conn.execute(insert(WorkerProcess).values(
+                    process_id=self.process_id, hostname=socket.gethostname(), pid=os.getpid(),
+                    started_at=now, **values
+                ))
+            # Clean up after processes that died without unregistering
+            dead = select(WorkerProcess.process_id).where(WorkerProcess.heartbeat_at < self._live_after())
+            conn.execute(delete(WorkerLease).where(WorkerLease.process_id.in_(dead)))
+            conn.execute(delete(WorkerProcess).where(WorkerProcess.heartbeat_at < self._live_after()))
+
+    def _remove_process(self):
+        with engine.begin() as conn:
+            conn.execute(delete(WorkerLease).where(WorkerLease.process_id == self.process_id))
+            conn.execute(delete(WorkerProcess).where(WorkerProcess.process_id == self.process_id))
+
+    def _live_leases(self):
+        live = select(WorkerProcess.process_id).where(WorkerProcess.heartbeat_at >= self._live_after())
+        cutoff = datetime.utcnow() - timedelta(seconds=LEASE_MAX_SECONDS)
+        return (
+            select(func.count()).select_from(WorkerLease)
+            .where(WorkerLease.process_id.in_(live), WorkerLease.acquired_at >= cutoff)
+        )
+
+    def _try_acquire(self, model_name: str) -> Optional[str]:
+        lease_id = secrets.token_hex(8)
+        try:
+            with engine.begin() as conn:
+                if engine.dialect.name == "postgresql":
+                    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+                # Count and insert in one statement, which SQLite runs under its write lock
+                candidate = select(
+                    literal(lease_id), literal(self.process_id), literal(model_name), literal(datetime.utcnow())
+                ).where(self._live_leases().scalar_subquery() < self.max_concurrency)
+                inserted = conn.execute(insert(WorkerLease).from_select(
+                    ["lease_id", "process_id", "model_name", "acquired_at"], candidate
+                )).rowcount
+        except OperationalError as e:
+            # Lock contention, treated like a full cap and retried
+            logger.debug(f"Lease acquisition contended: {e}")
+            return None
+        return lease_id if inserted else None
+
+    async def acquire(self, model_name: str) -> Optional[str]:
+        if not self.max_concurrency:
+            self.in_flight += 1
+            return "local"
+        delay = 0.02
+        with stage("global_slot_wait"):
+            while True:
+                lease_id = await asyncio.to_thread(self._try_acquire, model_name)
+                if lease_id is not None:
+                    self.in_flight += 1
+                    return lease_id
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
+    async def release(self, lease: Optional[str]):
+        if lease is None:
+            return
+        self.in_flight -= 1
+        if lease == "local":
+            return
+        try:
+            await asyncio.to_thread(self._release, lease)
+        except Exception as e:
+            # The lease expires after LEASE_MAX_SECONDS
+            logger.warning(f"Could not release lease {lease}: {e}")
+
+    def _release(self, lease_id: str):
+        with engine.begin() as conn:
+            conn.execute(delete(WorkerLease).where(WorkerLease.lease_id == lease_id))
+
+    def _read_cluster(self):
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(WorkerProcess.process_id, WorkerProcess.status)
+                .where(WorkerProcess.heartbeat_at >= self._live_after())
+            ).all()
+            in_flight = conn.execute(self._live_leases()).scalar() or 0
+        return rows, in_flight
+
+    async def cluster_status(self) -> dict:
+        rows, in_flight = await asyncio.to_thread(self._read_cluster)
+        # This process's own status is always current, the others are as of their last heartbeat
+        statuses = [self._status_provider()]
+        statuses += [json.loads(status) for process_id, status in rows if process_id != self.process_id]
+        if not self.max_concurrency:
+            in_flight = self.in_flight
+        return aggregate_status(statuses, in_flight, self.max_concurrency)
+
+
+def sync_id_sequence(name: str):
+    """Create the shared RequestLog id counter (SQLite), or move it past ids written without it"""
+    for attempt in range(2):
+        try:
+            with engine.begin() as conn:
+                next_value = (conn.execute(select(func.max(RequestLog.id))).scalar() or 0) + 1
+                updated = conn.execute(
+                    update(IdSequence).where(IdSequence.name == name)
+                    .values(next_value=func.max(IdSequence.next_value, next_value))
+                ).rowcount
+                if not updated:
+                    conn.execute(insert(IdSequence).values(name=name, next_value=next_value))
+            return
+        except IntegrityError:
+            # Another process created the counter at the same time, update it instead
+            if attempt:
+                raise
+
+
+def reserve_id_block(name: str, size: int) -> List[int]:
+    """Reserve `size` consecutive ids from a shared counter (SQLite deployments with several processes)"""
+    for _ in range(2):
+        with engine.begin() as conn:
+            # The UPDATE takes SQLite's write lock, so the read below sees our own increment
+            updated = conn.execute(
+                update(IdSequence).where(IdSequence.name == name).values(next_value=IdSequence.next_value + size)
+            ).rowcount
+            if updated:
+                end = conn.execute(select(IdSequence.next_value).where(IdSequence.name == name)).scalar_one()
+                return list(range(end - size, end))
+        sync_id_sequence(name)
+    raise RuntimeError(f"Id sequence '{name}' is missing")
+
+
+def create_coordinator() -> LocalCoordinator:
+    if COORDINATION_BACKEND == "database":
+        return DatabaseCoordinator()
+    return LocalCoordinator()
+
+
+coordinator = create_coordinator()
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import os
+from contextvars import ContextVar, Token
+from typing import AsyncIterator, Awaitable, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Status push settings, see GET /status/stream
+STATUS_PUSH_INTERVAL = float(os.getenv("STATUS_PUSH_INTERVAL", "1.0"))
+STATUS_KEEPALIVE_SECONDS = float(os.getenv("STATUS_KEEPALIVE_SECONDS", "15"))
+
+ProgressCallback = Callable[[str, dict], None]
+
+# Progress listener of the request being handled, None unless it was made through POST /label/stream
+_request_progress: ContextVar[Optional[ProgressCallback]] = ContextVar("request_progress", default=None)
+
+
+def current_progress() -> Optional[ProgressCallback]:
+    return _request_progress.get()
+
+
+def use_progress(callback: Optional[ProgressCallback]) -> Token:
+    return _request_progress.set(callback)
+
+
+def reset_progress(token: Token):
+    _request_progress.reset(token)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StatusBroadcaster:
+    """
+    Pushes the /status payload to every GET /status/stream subscriber.
+
+    The status is read once per interval for all subscribers, and only while
+    there are any, and sent only when the queue or workers have changed.
+    """
+
+    def __init__(self, interval: float = STATUS_PUSH_INTERVAL, keepalive: float = STATUS_KEEPALIVE_SECONDS):
+        self.interval = max(0.1, interval)
+        self.keepalive = keepalive
+        self._provider: Optional[Callable[[], Awaitable[dict]]] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._latest: Optional[dict] = None
+        self._has_subscribers = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, provider: Callable[[], Awaitable[dict]]):
+        """Start reading the status from provider"""
+        self._provider = provider
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._has_subscribers.wait()
+            try:
+                status = await self._provider()
+            except Exception as e:
+                logger.warning(f"Could not read status for push: {e}")
+            else:
+                self._publish(status)
+            await asyncio.sleep(self.interval)
+
+    def _publish(self, status: dict):
+        if self._latest is not None and _changes(self._latest) == _changes(status):
+            return
+        self._latest = status
+        for queue in self._subscribers:
+            # Slow subscribers only get the newest status
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(status)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """The status as Server-Sent Events, with a comment line as keepalive"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        if self._latest is not None:
+            queue.put_nowait(self._latest)
+        self._subscribers.add(queue)
+        self._has_subscribers.set()
+        try:
+            while True:
+                try:
+                    status = await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event("status", status)
+        finally:
+            self._subscribers.discard(queue)
+            if not self._subscribers:
+                self._has_subscribers.clear()
+                # Stale once nobody is watching, the next subscriber waits for a fresh read
+                self._latest = None
+
+
+def _changes(status: dict) -> dict:
+    # processing_time grows and the rate-limit buckets refill continuously, on their own
+    # they are not worth a push; they are sent along with the next real change
+    return {key: value for key, value in status.items() if key not in ("processing_time", "rate_limits")}
+
+
+status_broadcaster = StatusBroadcaster()
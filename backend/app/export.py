@@ -0,0 +1,217 @@
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from sqlmodel import Session, select
+
+from .models import RequestLog, FeedbackLog, engine
+
+# Rows fetched from the database cursor and written to the response at a time
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+EXPORT_COLUMNS = [
+    "request_id", "timestamp", "account_id", "model_name", "input_text", "predicted_label",
+    "processing_time", "error_message", "cache_hit", "knn_hit",
+    "routed_model", "routing_confidence", "escalated", "coalesced",
+    "prompt_format", "prompt_tokens", "completion_tokens",
+    "feedback_id", "feedback_timestamp", "is_supported", "corrected_label",
+]
+
+
+class ExportError(ValueError):
+    """Raised when an export cannot be produced with the requested options"""
+
+
+class LogFilters:
+    """Filters shared by the export endpoints"""
+
+    def __init__(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 account_id: Optional[str] = None, model_name: Optional[str] = None,
+                 label: Optional[str] = None):
+        self.start = start
+        self.end = end
+        self.account_id = account_id
+        self.model_name = model_name
+        self.label = label
+
+    def apply(self, query):
+        if self.start is not None:
+            query = query.where(RequestLog.timestamp >= self.start)
+        if self.end is not None:
+            query = query.where(RequestLog.timestamp < self.end)
+        if self.account_id:
+            query = query.where(RequestLog.account_id == self.account_id)
+        if self.model_name:
+            query = query.where(RequestLog.model_name == self.model_name)
+        if self.label:
+            query = query.where(RequestLog.predicted_label == self.label)
+        return query
+
+
+def _iter_chunks(filters: LogFilters, chunk_size: int) -> Iterator[List[dict]]:
+    """RequestLog rows left-joined with their feedback, read through a streaming cursor"""
+    query = filters.apply(
+        select(
+            RequestLog.id.label("request_id"),
+            RequestLog.timestamp,
+            RequestLog.account_id,
+            RequestLog.model_name,
+            RequestLog.input_text,
+            RequestLog.predicted_label,
+            RequestLog.processing_time,
+            RequestLog.error_message,
+            RequestLog.cache_hit,
+            RequestLog.knn_hit,
+            RequestLog.routed_model,
+            RequestLog.routing_confidence,
+            RequestLog.escalated,
+            RequestLog.coalesced,
+            RequestLog.prompt_format,
+            RequestLog.prompt_tokens,
+            RequestLog.completion_tokens,
+            FeedbackLog.id.label("feedback_id"),
+            FeedbackLog.timestamp.label("feedback_timestamp"),
+            FeedbackLog.is_supported,
+            FeedbackLog.corrected_label,
+        )
+        .join(FeedbackLog, FeedbackLog.request_id == RequestLog.id, isouter=True)
+        .order_by(RequestLog.id, FeedbackLog.id)
+    )
+    with Session(engine) as session:
+        # Plain column rows fetched chunk by chunk, with a server-side cursor on
+        # databases that support one, so memory stays flat however large the export
+        result = session.exec(query.execution_options(yield_per=chunk_size))
+        for partition in result.partitions():
+            yield [dict(row._mapping) for row in partition]
+
+
+def _export_csv(chunks: Iterator[List[dict]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _export_jsonl(chunks: Iterator[List[dict]]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose written bytes are taken out after each row group"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _export_parquet(chunks: Iterator[List[dict]]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("request_id", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("account_id", pa.string()),
+        ("model_name", pa.string()),
+        ("input_text", pa.string()),
+        ("predicted_label", pa.string()),
+        ("processing_time", pa.float64()),
+        ("error_message", pa.string()),
+        ("cache_hit", pa.bool_()),
+        ("knn_hit", pa.bool_()),
+        ("routed_model", pa.string()),
+        ("routing_confidence", pa.float64()),
+        ("escalated", pa.bool_()),
+        ("coalesced", pa.bool_()),
+        ("prompt_format", pa.string()),
+        ("prompt_tokens", pa.int64()),
+        ("completion_tokens", pa.int64()),
+        ("feedback_id", pa.int64()),
+        ("feedback_timestamp", pa.timestamp("us")),
+        ("is_supported", pa.bool_()),
+        ("corrected_label", pa.string()),
+    ])
+    sink = _ChunkSink()
+    # One row group per chunk, streamed out as soon as it is written
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def export_logs(export_format: str, filters: LogFilters, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Stream the filtered request/feedback log as CSV, JSONL or Parquet.
+    :raises ExportError: for an unknown format, or Parquet without pyarrow installed
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ExportError("Parquet export requires the pyarrow package")
+
+    chunks = _iter_chunks(filters, max(1, chunk_size))
+    if export_format == "csv":
+        return _export_csv(chunks)
+    if export_format == "jsonl":
+        return _export_jsonl(chunks)
+    return _export_parquet(chunks)
+
+
+def sqlite_snapshot() -> str:
+    """
+    Copy the live SQLite database to a temporary file with SQLite's online backup API,
+    which gives a consistent snapshot while the app keeps writing.
+    :return: Path of the snapshot file, the caller deletes it
+    :raises ExportError: when the database is not SQLite
+    """
+    if engine.dialect.name != "sqlite" or not engine.url.database:
+        raise ExportError("Database snapshots are only available for SQLite, use your database's backup tools instead")
+
+    handle, snapshot_path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    source = sqlite3.connect(engine.url.database)
+    destination = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(destination)
+    finally:
+        destination.close()
+        source.close()
+    return snapshot_path
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from .models import FeedbackLog, RequestLog, engine
+from .labeling import LABELS, FEW_SHOT_STRATEGY, normalize_text
+from .metrics import KNN_LOOKUPS, KNN_INDEX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Nearest-neighbour pre-classifier over labels confirmed or corrected through /feedback, off by default
+KNN_ENABLED = os.getenv("KNN_ENABLED", "false").lower() == "true"
+KNN_NEIGHBORS = int(os.getenv("KNN_NEIGHBORS", "5"))
+# Neighbours less similar than this (cosine) are ignored
+KNN_MIN_SIMILARITY = float(os.getenv("KNN_MIN_SIMILARITY", "0.8"))
+# Minimum confidence (similarity-weighted vote share x best similarity) to answer without the LLM
+KNN_CONFIDENCE_THRESHOLD = float(os.getenv("KNN_CONFIDENCE_THRESHOLD", "0.9"))
+# How often feedback written by other processes is picked up
+KNN_REFRESH_SECONDS = float(os.getenv("KNN_REFRESH_SECONDS", "30"))
+
+REFRESH_CHUNK_SIZE = 5000
+
+
+def _feedback_label(request_log_label: Optional[str], is_supported: bool, corrected_label: Optional[str]) -> Optional[str]:
+    """The label feedback establishes for a text, None if it only says the prediction was wrong"""
+    if corrected_label:
+        return corrected_label
+    if is_supported:
+        return request_log_label
+    return None
+
+
+class FeedbackIndex:
+    """
+    In-memory nearest-neighbour index of texts whose label was confirmed or
+    corrected through /feedback, one entry per request (its latest feedback wins).
+
+    Texts are vectorized with scikit-learn's stateless HashingVectorizer, so new
+    feedback is added without refitting anything, and rows are L2-normalized so a
+    sparse dot product gives cosine similarities.
+    """
+
+    def __init__(self, classify_enabled: bool = KNN_ENABLED, neighbors: int = KNN_NEIGHBORS,
+                 min_similarity: float = KNN_MIN_SIMILARITY,
+                 confidence_threshold: float = KNN_CONFIDENCE_THRESHOLD,
+                 refresh_seconds: float = KNN_REFRESH_SECONDS,
+                 examples_enabled: bool = FEW_SHOT_STRATEGY == "similar"):
+        # The index is kept for the pre-classifier and/or for few-shot example selection
+        self.classify_enabled = classify_enabled
+        self.enabled = classify_enabled or examples_enabled
+        self.neighbors = max(1, neighbors)
+        self.min_similarity = min_similarity
+        self.confidence_threshold = confidence_threshold
+        self.refresh_seconds = refresh_seconds
+        self._vectorizer = None
+        self._lock = threading.Lock()
+        self._texts: List[str] = []
+        self._labels: List[Optional[str]] = []
+        self._pending_rows: list = []  # vectors not stacked onto the matrix yet
+        self._positions: Dict[int, int] = {}  # request id -> entry
+        self._matrix = None
+        self._last_feedback_id = 0
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+        self.lookups = 0
+        self.hits = 0
+
+    async def start(self):
+        """Build the index from the feedback history in the background and keep it refreshed"""
+        if not self.enabled or self._task is not None:
+            return
+        try:
+            from sklearn.feature_extraction.text import HashingVectorizer
+        except ImportError:
+            logger.warning("The feedback index needs scikit-learn, which is not installed; it is disabled")
+            self.enabled = False
+            self.classify_enabled = False
+            return
+        self._vectorizer = HashingVectorizer(
+            n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False, norm="l2"
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                self.loaded = True
+            except Exception as e:
+                logger.warning(f"Refreshing the feedback index failed: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def refresh(self):
+        """Apply feedback written since the last refresh, by this or any other process"""
+        while True:
+            with Session(engine) as session:
+                rows = session.exec(
+                    select(FeedbackLog.id, FeedbackLog.request_id, FeedbackLog.is_supported, FeedbackLog.corrected_label,
+                           RequestLog.input_text, RequestLog.predicted_label)
+                    .join(RequestLog, FeedbackLog.request_id == RequestLog.id)
+                    .where(FeedbackLog.id > self._last_feedback_id)
+                    .order_by(FeedbackLog.id)
+                    .limit(REFRESH_CHUNK_SIZE)
+                ).all()
+            if not rows:
+                return
+            # Vectorize the whole chunk at once, texts already in the index only change label
+            vectors = self._vectorizer.transform([normalize_text(row[4]) for row in rows])
+            for i, (feedback_id, request_id, is_supported, corrected_label, input_text, predicted_label) in enumerate(rows):
+                label = _feedback_label(predicted_label, is_supported, corrected_label)
+                self.add(request_id, input_text, label, vectors[i])
+            self._last_feedback_id = rows[-1][0]
+
+    def add(self, request_id: int, text: str, label: Optional[str], vector=None):
+        """Set the label feedback gave a request's text; None removes it from the votes"""
+        if self._vectorizer is None:
+            return
+        text = normalize_text(text)
+        with self._lock:
+            position = self._positions.get(request_id)
+            if position is not None:
+                self._labels[position] = label
+                return
+            if label is None:
+                return
+            self._positions[request_id] = len(self._texts)
+            self._texts.append(text)
+            self._labels.append(label)
+            self._pending_rows.append(vector if vector is not None else self._vectorizer.transform([text]))
+            KNN_INDEX_SIZE.set(len(self._texts))
+
+    def add_feedback(self, request_log: RequestLog, is_supported: bool, corrected_label: Optional[str]):
+        """Update the index right away for feedback submitted to this process"""
+        self.add(request_log.id, request_log.input_text,
+                 _feedback_label(request_log.predicted_label, is_supported, corrected_label))
+
+    def _get_matrix(self):
+        from scipy.sparse import vstack
+        with self._lock:
+            # Vectors added since the last lookup are stacked onto the matrix once
+            if self._pending_rows:
+                blocks = ([self._matrix] if self._matrix is not None else []) + self._pending_rows
+                self._matrix = vstack(blocks, format="csr")
+                self._pending_rows = []
+            return self._matrix
+
+    def nearest(self, text: str, count: int) -> List[Tuple[str, str, float]]:
+        """Up to `count` of the most similar labeled texts as (text, label, similarity), most similar first"""
+        if self._vectorizer is None or not self._texts:
+            return []
+        matrix = self._get_matrix()
+        scores = (matrix @ self._vectorizer.transform([normalize_text(text)]).T).toarray().ravel()
+        size = len(scores)
+        count = min(count, size)
+        top = scores.argpartition(-count)[-count:] if count < size else range(size)
+        ranked = sorted(top, key=lambda position: -scores[position])
+        # Entries are only appended, so positions stay valid without holding the lock
+        return [
+            (self._texts[position], self._labels[position], float(scores[position]))
+            for position in ranked if self._labels[position] is not None
+        ]
+
+    def classify(self, text: str) -> Optional[Tuple[str, float]]:
+        """
+        Label text from its nearest neighbours when they agree with enough confidence
+        :return: Tuple of (label, confidence), or None to fall through to the LLM
+        """
+        if not self.classify_enabled or not self.loaded:
+            return None
+        self.lookups += 1
+        votes: Dict[str, float] = defaultdict(float)
+        best: Dict[str, float] = defaultdict(float)
+        for _, label, similarity in self.nearest(text, self.neighbors):
+            if similarity >= self.min_similarity and label in LABELS:
+                votes[label] += similarity
+                best[label] = max(best[label], similarity)
+        if not votes:
+            KNN_LOOKUPS.labels("miss").inc()
+            return None
+
+        label = max(votes, key=votes.get)
+        confidence = votes[label] / sum(votes.values()) * best[label]
+        if confidence < self.confidence_threshold:
+            KNN_LOOKUPS.labels("low_confidence").inc()
+            return None
+        KNN_LOOKUPS.labels("hit").inc()
+        self.hits += 1
+        return label, confidence
+
+    def stats(self) -> dict:
+        """Index size and bypass rate since process start"""
+        return {
+            "enabled": self.enabled,
+            "classify_enabled": self.classify_enabled,
+            "loaded": self.loaded,
+            "size": len(self._texts),
+            "neighbors": self.neighbors,
+            "min_similarity": self.min_similarity,
+            "confidence_threshold": self.confidence_threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "bypass_rate": self.hits / self.lookups if self.lookups else 0.0
+        }
+
+
+feedback_index = FeedbackIndex()
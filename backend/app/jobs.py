@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlmodel import Session, select, func, insert, update
+
+from .models import LabelJob, LabelJobItem, engine
+from .batch import label_chunks
+
+logger = logging.getLogger(__name__)
+
+# Job settings
+JOB_MAX_ROWS = int(os.getenv("JOB_MAX_ROWS", "100000"))
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "2"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# LabelJobItem rows per INSERT statement when a job is created
+ITEM_INSERT_CHUNK_SIZE = 5000
+
+
+class JobManager:
+    """
+    Runs labeling jobs in the background.
+
+    Job metadata and every row live in the LabelJob/LabelJobItem tables; a row's
+    result is committed in the same transaction as its RequestLog entry, so a job
+    interrupted by a restart resumes with only the rows that were never labeled.
+    """
+
+    def __init__(self, max_running: int = JOB_MAX_RUNNING):
+        self.max_running = max(1, max_running)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        # job id -> (monotonic start of the current run, rows done when it started)
+        self._run_started: Dict[str, tuple] = {}
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_running)
+        return self._slots
+
+    async def create_job(self, texts: List[str], model_name: str, account_id: str) -> LabelJob:
+        """Persist a new job with its rows and schedule it"""
+        job = LabelJob(
+            id=uuid.uuid4().hex,
+            account_id=account_id,
+            model_name=model_name,
+            total_rows=len(texts)
+        )
+        # Up to JOB_MAX_ROWS rows, written off the event loop
+        job = await asyncio.to_thread(self._insert_job, job, texts)
+        self._schedule(job.id)
+        return job
+
+    def _insert_job(self, job: LabelJob, texts: List[str]) -> LabelJob:
+        with Session(engine, expire_on_commit=False) as session:
+            session.add(job)
+            session.flush()
+            # Core multi-row inserts, the ORM would build an object per row
+            for start in range(0, len(texts), ITEM_INSERT_CHUNK_SIZE):
+                session.exec(insert(LabelJobItem), params=[
+                    {"job_id": job.id, "row_index": i, "input_text": text, "status": "pending", "cache_hit": False}
+                    for i, text in enumerate(texts[start:start + ITEM_INSERT_CHUNK_SIZE], start=start)
+                ])
+            session.commit()
+        return job
+
+    def resume_incomplete(self):
+        """Reschedule jobs that were queued or running when the server stopped"""
+        with Session(engine) as session:
+            job_ids = session.exec(
+                select(LabelJob.id).where(LabelJob.status.in_(ACTIVE_STATUSES)).order_by(LabelJob.created_at)
+            ).all()
+        for job_id in job_ids:
+            logger.info(f"Resuming labeling job {job_id}")
+            self._schedule(job_id)
+
+    def _schedule(self, job_id: str):
+        if job_id not in self._tasks:
+            task = asyncio.create_task(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, job_id: str):
+        async with self._get_slots():
+            started = await asyncio.to_thread(self._start_run, job_id)
+            if started is None:
+                return
+            model_name, account_id, done_rows, items = started
+
+            item_ids = [item_id for item_id, _ in items]
+            texts = [text for _, text in items]
+            self._run_started[job_id] = (time.monotonic(), done_rows)
+
+            def record_chunk(session: Session, rows: List[dict]):
+                completed = failed = 0
+                for row in rows:
+                    labeled = row["predicted_label"] is not None
+                    session.exec(
+                        update(LabelJobItem)
+                        .where(LabelJobItem.id == item_ids[row["index"]])
+                        .values(
+                            status="done" if labeled else "failed",
+                            predicted_label=row["predicted_label"],
+                            error_message=row["error_message"],
+                            processing_time=row["processing_time"],
+                            cache_hit=row["cache_hit"],
+                            request_id=row["id"]
+                        )
+                    )
+                    if labeled:
+                        completed += 1
+                    else:
+                        failed += 1
+                session.exec(
+                    update(LabelJob)
+                    .where(LabelJob.id == job_id)
+                    .values(
+                        completed_rows=LabelJob.completed_rows + completed,
+                        failed_rows=LabelJob.failed_rows + failed
+                    )
+                )
+
+            try:
+                async for _ in label_chunks(texts, model_name, account_id, on_chunk=record_chunk):
+                    pass
+                await asyncio.to_thread(self._finish, job_id, "completed")
+            except asyncio.CancelledError:
+                # Either cancelled through the API (status already set) or the server is
+                # shutting down, in which case the job stays active and resumes on restart
+                raise
+            except Exception as e:
+                logger.exception(f"Labeling job {job_id} failed")
+                await asyncio.to_thread(self._finish, job_id, "failed", str(e))
+            finally:
+                self._run_started.pop(job_id, None)
+
+    def _start_run(self, job_id: str) -> Optional[tuple]:
+        """Mark an active job as running; returns its model, account, rows done and pending (id, text) items"""
+        with Session(engine) as session:
+            job = session.get(LabelJob, job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return None
+            job.status = "running"
+            job.started_at = job.started_at or datetime.utcnow()
+            session.add(job)
+            session.commit()
+
+            # Only rows without a committed result are sent to the model
+            items = session.exec(
+                select(LabelJobItem.id, LabelJobItem.input_text)
+                .where(LabelJobItem.job_id == job_id, LabelJobItem.status == "pending")
+                .order_by(LabelJobItem.row_index)
+            ).all()
+            return job.model_name, job.account_id, job.completed_rows + job.failed_rows, items
+
+    def _finish(self, job_id: str, job_status: str, error_message: Optional[str] = None) -> bool:
+        """Move an active job to a final status; returns False if it had already finished"""
+        with Session(engine) as session:
+            job = session.get(LabelJob, job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return False
+            job.status = job_status
+            job.error_message = error_message
+            job.finished_at = datetime.utcnow()
+            session.add(job)
+            session.commit()
+            return True
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it had already finished"""
+        if not await asyncio.to_thread(self._finish, job_id, "cancelled"):
+            return False
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        return True
+
+    async def stop(self):
+        """Stop running jobs without changing their status so they resume on restart"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._slots = None
+
+    def progress(self, job: LabelJob) -> dict:
+        """Progress and ETA of a job"""
+        done_rows = job.completed_rows + job.failed_rows
+        eta_seconds = None
+        run = self._run_started.get(job.id)
+        if job.status == "running" and run is not None:
+            run_start, rows_at_start = run
+            elapsed = time.monotonic() - run_start
+            rows_this_run = done_rows - rows_at_start
+            if rows_this_run > 0:
+                eta_seconds = elapsed / rows_this_run * (job.total_rows - done_rows)
+        return {
+            "job_id": job.id,
+            "account_id": job.account_id,
+            "model_name": job.model_name,
+            "status": job.status,
+            "total_rows": job.total_rows,
+            "completed_rows": job.completed_rows,
+            "failed_rows": job.failed_rows,
+            "progress": done_rows / job.total_rows if job.total_rows else 1.0,
+            "eta_seconds": eta_seconds,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "error_message": job.error_message
+        }
+
+    def results(self, session: Session, job_id: str, offset: int, limit: int) -> dict:
+        """One page of a job's rows in input order"""
+        items = session.exec(
+            select(LabelJobItem)
+            .where(LabelJobItem.job_id == job_id)
+            .order_by(LabelJobItem.row_index)
+            .offset(offset)
+            .limit(limit)
+        ).all()
+        total = session.exec(select(func.count(LabelJobItem.id)).where(LabelJobItem.job_id == job_id)).first()
+        return {
+            "job_id": job_id,
+            "offset": offset,
+            "limit": limit,
+            "total": total,
+            "results": [
+                {
+                    "index": item.row_index,
+                    "request_id": item.request_id,
+                    "input_text": item.input_text,
+                    "status": item.status,
+                    "predicted_label": item.predicted_label,
+                    "error_message": item.error_message,
+                    "processing_time": item.processing_time,
+                    "cache_hit": item.cache_hit
+                }
+                for item in items
+            ]
+        }
+
+
+job_manager = JobManager()
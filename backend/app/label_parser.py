@@ -0,0 +1,109 @@
+import difflib
+import os
+import re
+from typing import Dict, List, Optional
+
+# Minimum difflib similarity ratio for the fuzzy fallback, 1.0 disables it
+LABEL_FUZZY_CUTOFF = float(os.getenv("LABEL_FUZZY_CUTOFF", "0.85"))
+# A truncated answer must keep at least this many characters to be completed from the trie
+MIN_PREFIX_LENGTH = 4
+# Raw outputs remembered per matcher, answers repeat a lot
+MATCH_CACHE_SIZE = 4096
+
+# "Label: ...", "Answer - ..." and similar lead-ins models put before the label
+_LEAD_IN = re.compile(r"^(?:the\s+)?(?:label|answer|category|output)\s*(?:is)?\s*[:\-]\s*")
+_EDGE_PUNCTUATION = " \t\"'`*.,;:!?"
+
+
+def normalize_output(text: str) -> str:
+    """Case-fold and strip quotes, trailing punctuation and whitespace variations"""
+    text = " ".join(text.split()).casefold().strip(_EDGE_PUNCTUATION)
+    return _LEAD_IN.sub("", text).strip(_EDGE_PUNCTUATION)
+
+
+class _TrieNode:
+    __slots__ = ("children", "label")
+
+    def __init__(self, label: Optional[str]):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.label = label  # the only label with a key through this node, None if several
+
+
+class LabelMatcher:
+    """
+    Maps a raw model answer to one of the canonical labels, or None.
+
+    Built once per taxonomy; tried in order:
+    1. exact lookup of the normalized answer among the normalized labels, their
+       part after " - " where that is unique (e.g. "Hedge fund") and label codes
+    2. a character trie over the normalized labels and short forms, so an answer
+       cut off by max_tokens still resolves when it is a prefix of a single label
+    3. difflib closest match above LABEL_FUZZY_CUTOFF, for typos and small rewordings
+    """
+
+    def __init__(self, labels: List[str], codes: Optional[Dict[str, str]] = None,
+                 fuzzy_cutoff: float = LABEL_FUZZY_CUTOFF):
+        self.labels = list(labels)
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._exact: Dict[str, str] = {}
+        self._root = _TrieNode(None)
+        for label in self.labels:
+            self._add(normalize_output(label), label)
+        # Short forms only where they cannot be confused with another label
+        short_forms: Dict[str, List[str]] = {}
+        for label in self.labels:
+            if " - " in label:
+                short_forms.setdefault(normalize_output(label.split(" - ", 1)[1]), []).append(label)
+        for short_form, matches in short_forms.items():
+            if len(matches) == 1 and short_form not in self._exact:
+                self._add(short_form, matches[0])
+        # Codes are matched exactly only, a prefix of "L1" says nothing
+        for code, label in (codes or {}).items():
+            self._exact[normalize_output(code)] = label
+        self._cache: Dict[str, Optional[str]] = {}
+
+    def _add(self, key: str, label: str):
+        self._exact[key] = label
+        self._insert(key, label)
+
+    def _insert(self, key: str, label: str):
+        node = self._root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode(label)
+            elif child.label != label:
+                child.label = None
+            node = child
+
+    def _walk(self, key: str) -> Optional[_TrieNode]:
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def match(self, output: str) -> Optional[str]:
+        """The canonical label for a model answer, None if it matches no label"""
+        if output in self._cache:
+            return self._cache[output]
+
+        # Like autolabel, the last non-empty line holds the answer
+        lines = [line for line in output.strip().splitlines() if line.strip()]
+        key = normalize_output(lines[-1]) if lines else ""
+        label = None
+        if key:
+            label = self._exact.get(key)
+            node = self._walk(key) if label is None else None
+            if node is not None:
+                # A prefix shared by several labels stays unresolved, fuzzy matching would just pick the shortest
+                label = node.label if len(key) >= MIN_PREFIX_LENGTH else None
+            elif label is None and self.fuzzy_cutoff < 1.0:
+                close = difflib.get_close_matches(key, self._exact.keys(), n=1, cutoff=self.fuzzy_cutoff)
+                label = self._exact[close[0]] if close else None
+
+        if len(self._cache) >= MATCH_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[output] = label
+        return label
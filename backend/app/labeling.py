@@ -1,16 +1,65 @@
-import pandas as pd
-from autolabel import LabelingAgent, AutolabelDataset
-import tempfile
 import os
-import csv
-from typing import Tuple, Optional
+import re
+import json
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING, Tuple, Optional, Dict, List
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import contextvars
+import functools
 import time
 
-# Global lock for concurrency control
-_processing_lock = asyncio.Lock()
-_current_user = None
-_processing_start_time = None
+from .openai_client import openai_client
+from .batcher import MicroBatcher
+from .label_parser import LabelMatcher
+from .metrics import stage, NO_LABEL_RESULTS, ROUTING_DECISIONS
+
+# autolabel pulls in langchain, torch, scipy and pandas, several seconds of imports;
+# they are deferred to the first agent build, which warm_agents runs after startup
+if TYPE_CHECKING:
+    from langchain.schema import Generation
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_MODELS = ["gpt-4", "gpt-3.5-turbo"]
+
+# Completion token limit per label; answers cut off by it are still resolved by
+# label_parser.LabelMatcher as long as they are a prefix of a single label
+LABEL_MAX_TOKENS = int(os.getenv("LABEL_MAX_TOKENS", "15"))
+
+# "labels" has the model answer with the full label name; "ids" lists each label once,
+# with a short ID and its description, and has the model answer with the ID only
+PROMPT_FORMAT = os.getenv("PROMPT_FORMAT", "labels").lower()
+# Completion token limit of the "ids" format, an ID like "L07" is 2 tokens
+LABEL_ID_MAX_TOKENS = 4
+
+# model_name "auto" labels with the primary model and escalates to the escalation
+# model when its answer is not a known label or its confidence is too low
+AUTO_MODEL = "auto"
+ROUTING_PRIMARY_MODEL = os.getenv("ROUTING_PRIMARY_MODEL", "gpt-3.5-turbo")
+ROUTING_ESCALATION_MODEL = os.getenv("ROUTING_ESCALATION_MODEL", "gpt-4")
+# Average token probability of the primary answer (autolabel's logprob_average) needed to keep it
+ROUTING_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTING_CONFIDENCE_THRESHOLD", "0.9"))
+
+# "pooled" sends prompts through the shared async OpenAI client (see openai_client.py),
+# "autolabel" uses each agent's own langchain client in the labeling thread pool
+LLM_BACKEND = os.getenv("LLM_BACKEND", "pooled")
+
+# Blocking work (agent construction, the "autolabel" LLM backend) is executed
+# in a dedicated thread pool to keep the event loop responsive
+LABEL_EXECUTOR_WORKERS = int(os.getenv("LABEL_EXECUTOR_WORKERS", os.getenv("LABEL_WORKERS", "4")))
+_executor: Optional[ThreadPoolExecutor] = None
+
+# "static" keeps the prompt create_config builds; "similar" adds the texts labeled through
+# /feedback that are most similar to the input as few-shot examples (see feedback_index.py)
+FEW_SHOT_STRATEGY = os.getenv("FEW_SHOT_STRATEGY", "static").lower()
+FEW_SHOT_MAX_EXAMPLES = int(os.getenv("FEW_SHOT_MAX_EXAMPLES", "4"))
+# Estimated prompt tokens (~4 characters per token) all examples of one prompt may add
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv("FEW_SHOT_TOKEN_BUDGET", "400"))
+# Feedback texts less similar than this (cosine) are not used as examples
+FEW_SHOT_MIN_SIMILARITY = float(os.getenv("FEW_SHOT_MIN_SIMILARITY", "0.1"))
 
 # Labels and descriptions from the original script
 LABELS = [
@@ -65,17 +114,45 @@ LABEL_DESCRIPTIONS = {
     "Insurance - Value added services": "Risk Assessment & Consulting, Claims Management."
 }
 
-def create_config(model_name: str = "gpt-4"):
-    """Create configuration for the labeling agent"""
-    
-    label_guidelines = """You are an expert in categorizing the business line or product in financial services roles based on their respective industries and job functions.
+# (in-process fingerprint, sha256 version) of the last seen taxonomy
+_taxonomy_version: Tuple[Optional[int], str] = (None, "")
+
+def taxonomy_version() -> str:
+    """Short hash of the label taxonomy, changes whenever LABELS or LABEL_DESCRIPTIONS are edited"""
+    global _taxonomy_version
+    # Builtin hashing of the (already hashed) strings is cheap enough to run per request,
+    # the stable sha256 is only recomputed when the taxonomy actually changed
+    fingerprint = hash((tuple(LABELS), tuple(LABEL_DESCRIPTIONS.items())))
+    if _taxonomy_version[0] != fingerprint:
+        payload = json.dumps([LABELS, LABEL_DESCRIPTIONS], sort_keys=True)
+        _taxonomy_version = (fingerprint, hashlib.sha256(payload.encode()).hexdigest()[:16])
+    return _taxonomy_version[1]
+
+# (taxonomy_version, ID -> label) of the last build
+_label_codes: Tuple[Optional[str], Dict[str, str]] = (None, {})
+
+def label_codes() -> Dict[str, str]:
+    """Short IDs of the labels ("L01" for the first of LABELS), rebuilt only when the taxonomy changes"""
+    global _label_codes
+    version = taxonomy_version()
+    if _label_codes[0] != version:
+        _label_codes = (version, {f"L{i:02d}": label for i, label in enumerate(LABELS, start=1)})
+    return _label_codes[1]
+
+SINGLE_LABEL_INSTRUCTION = "\nImportant: Please return only one of the above labels, without any additional text, punctuation, or explanation."
+SINGLE_ID_INSTRUCTION = "\nImportant: Please return only the ID of one of the above labels, without the label name or any additional text, punctuation, or explanation."
+
+_GUIDELINES_INTRO = """You are an expert in categorizing the business line or product in financial services roles based on their respective industries and job functions.
     Your task is to categorize each experience from the input text into the appropriate label.
     
         Important rules:
     - Always focus on the business line or product the employee worked on and financial services-related terminology in the text.
     - Don't be distracted by position or company name; focus entirely on the responsibilities and tasks in the experience description.
  
-    Choose the most appropriate label from:
+"""
+
+def _build_task_guidelines() -> str:
+    label_guidelines = _GUIDELINES_INTRO + """    Choose the most appropriate label from:
     {labels}
     
     Label descriptions:
@@ -84,7 +161,34 @@ def create_config(model_name: str = "gpt-4"):
     for label, desc in LABEL_DESCRIPTIONS.items():
         label_guidelines += f"- {label}: {desc}\n"
    
-    label_guidelines += "\nImportant: Please return only one of the above labels, without any additional text, punctuation, or explanation."
+    label_guidelines += SINGLE_LABEL_INSTRUCTION
+    return label_guidelines
+
+def _build_id_task_guidelines() -> str:
+    # Each label and its description appear once, the {labels} list is left out
+    label_guidelines = _GUIDELINES_INTRO + """    Choose the most appropriate label from (ID | label: description):
+"""
+    for code, label in label_codes().items():
+        label_guidelines += f"{code} | {label}: {LABEL_DESCRIPTIONS.get(label, '')}\n"
+    label_guidelines += SINGLE_ID_INSTRUCTION
+    return label_guidelines
+
+# (taxonomy_version, guidelines) of the last build
+_task_guidelines: Tuple[Optional[str], str] = (None, "")
+
+def get_task_guidelines() -> str:
+    """Get the task guidelines, rebuilt only when the taxonomy changes"""
+    global _task_guidelines
+    version = taxonomy_version()
+    if _task_guidelines[0] != version:
+        build = _build_id_task_guidelines if PROMPT_FORMAT == "ids" else _build_task_guidelines
+        _task_guidelines = (version, build())
+    return _task_guidelines[1]
+
+def create_config(model_name: str = "gpt-4"):
+    """Create configuration for the labeling agent"""
+    
+    label_guidelines = get_task_guidelines()
  
     config = {
         "task_name": "SentimentClassification",
@@ -94,7 +198,7 @@ def create_config(model_name: str = "gpt-4"):
             "name": model_name,
             "parameters": {
                 "temperature": 0.2,
-                "max_tokens": 15
+                "max_tokens": LABEL_MAX_TOKENS
             }
         },
         "dataset": {
@@ -119,88 +223,444 @@ def create_config(model_name: str = "gpt-4"):
             ]
         }
     }
+    if FEW_SHOT_STRATEGY == "similar":
+        # Puts autolabel in few-shot mode, the examples themselves are chosen per text by _AgentEntry
+        config["dataset"]["label_column"] = "label"
+        config["prompt"]["example_template"] = "Text: {text}\nLabel: {label}"
+        config["prompt"]["few_shot_selection"] = "fixed"
+        config["prompt"]["few_shot_num"] = FEW_SHOT_MAX_EXAMPLES
+    if PROMPT_FORMAT == "ids":
+        config["model"]["parameters"]["max_tokens"] = LABEL_ID_MAX_TOKENS
+        config["prompt"]["output_guidelines"] = "Return ONLY the ID of the label from the list above (for example L01). Do not add the label name or any additional text, explanation, or punctuation."
     return config
 
+def _estimate_example_tokens(example: dict) -> int:
+    return (len(example["text"]) + len(example["label"]) + len("Text: \nLabel: \n\n")) // 4
+
+def select_examples(text: str, seed_examples: List[dict]) -> List[dict]:
+    """
+    Few-shot examples for one text: the most similar feedback texts, one per label
+    first so close competing labels are all shown, then further neighbours and the
+    seed examples, within FEW_SHOT_MAX_EXAMPLES and FEW_SHOT_TOKEN_BUDGET
+    """
+    from .feedback_index import feedback_index
+
+    neighbours = [
+        {"text": neighbour_text, "label": label}
+        for neighbour_text, label, similarity in feedback_index.nearest(text, FEW_SHOT_MAX_EXAMPLES * 4)
+        if similarity >= FEW_SHOT_MIN_SIMILARITY and label in LABELS
+    ]
+    seen_labels = set()
+    diverse, rest = [], []
+    for example in neighbours:
+        (rest if example["label"] in seen_labels else diverse).append(example)
+        seen_labels.add(example["label"])
+
+    examples, used_texts, tokens = [], set(), 0
+    for example in diverse + rest + seed_examples:
+        if len(examples) >= FEW_SHOT_MAX_EXAMPLES:
+            break
+        cost = _estimate_example_tokens(example)
+        if example["text"] in used_texts or tokens + cost > FEW_SHOT_TOKEN_BUDGET:
+            continue
+        examples.append(example)
+        used_texts.add(example["text"])
+        tokens += cost
+    return examples
+
+MULTI_ITEM_OUTPUT_GUIDELINES = (
+    "You will be given {count} numbered texts. Label each text independently. "
+    "Return exactly one line per text, in the same order, in the form <number>: <label>, "
+    "using only the exact labels from the list above and no additional text, explanation, or punctuation."
+)
+MULTI_ITEM_ID_OUTPUT_GUIDELINES = (
+    "You will be given {count} numbered texts. Label each text independently. "
+    "Return exactly one line per text, in the same order, in the form <number>: <ID>, "
+    "using only the label IDs from the list above and no additional text, explanation, or punctuation."
+)
+
+# "3: Research - Equity research", also accepting "3." or "3)" after the number
+_NUMBERED_LINE = re.compile(r"^\s*(\d+)\s*[:.)]\s*(.+?)\s*$")
+
+def normalize_text(text: str) -> str:
+    """Clean and format the text before it is put into the prompt"""
+    text = text.strip()
+    text = text.replace('\n', ' ')  # Replace newlines with spaces
+    return ' '.join(text.split())   # Normalize whitespace
+
 async def get_label(text: str, model_name: str = "gpt-4", account_id: str = "unknown") -> Tuple[Optional[str], Optional[str], float]:
     """
-    Label a single text with concurrency control
+    Label a single text. Concurrency is controlled by the caller (see scheduler.LabelScheduler)
     :param text: Input text
     :param model_name: Model to use (gpt-4 or gpt-3.5-turbo)
     :param account_id: User account ID
     :return: Tuple of (predicted_label, error_message, processing_time)
     """
-    global _current_user, _processing_start_time
-    
-    # Check if system is busy
-    if _processing_lock.locked():
-        return None, f"System is busy. User '{_current_user}' is currently processing a request.", 0
-    
+    if micro_batcher.enabled and LLM_BACKEND == "pooled":
+        # Concurrent requests share one multi-item prompt (see batcher.py)
+        return await micro_batcher.label(text, model_name)
+    results, processing_time = await label_texts([text], model_name)
+    predicted_label, error_message = results[0]
+    return predicted_label, error_message, processing_time
+
+async def get_routed_label(text: str, account_id: str = "unknown") -> Tuple[Optional[str], Optional[str], float, Optional[str], Optional[float]]:
+    """
+    Label a single text for model_name "auto": ROUTING_PRIMARY_MODEL first, then
+    ROUTING_ESCALATION_MODEL if the primary answer is not one of LABELS or its
+    confidence is below ROUTING_CONFIDENCE_THRESHOLD. Without logprobs (the
+    "autolabel" backend) only invalid answers are escalated.
+    :return: Tuple of (predicted_label, error_message, processing_time, model that answered, primary confidence)
+    """
     start_time = time.time()
-    
+    predicted_label, error_message, confidence = await _label_scored(text, ROUTING_PRIMARY_MODEL)
+    if predicted_label is None or predicted_label not in LABELS:
+        decision = "escalated_invalid"
+    elif confidence is not None and confidence < ROUTING_CONFIDENCE_THRESHOLD:
+        decision = "escalated_low_confidence"
+    else:
+        ROUTING_DECISIONS.labels("accepted").inc()
+        return predicted_label, error_message, time.time() - start_time, ROUTING_PRIMARY_MODEL, confidence
+
+    ROUTING_DECISIONS.labels(decision).inc()
+    predicted_label, error_message, _ = await _label_scored(text, ROUTING_ESCALATION_MODEL, logprobs=False)
+    return predicted_label, error_message, time.time() - start_time, ROUTING_ESCALATION_MODEL, confidence
+
+async def _label_scored(text: str, model_name: str, logprobs: bool = True) -> Tuple[Optional[str], Optional[str], Optional[float]]:
+    if LLM_BACKEND == "autolabel":
+        results, _ = await _run_in_executor(_label_many, [text], model_name)
+        return (*results[0], None)
+
+    with stage("normalize"):
+        text = normalize_text(text)
     try:
-        async with _processing_lock:
-            _current_user = account_id
-            _processing_start_time = start_time
-            
-            # Clean and format the text
-            text = text.strip()
-            text = text.replace('\n', ' ')  # Replace newlines with spaces
-            text = ' '.join(text.split())   # Normalize whitespace
-            
-            # Create configuration
-            config = create_config(model_name)
-            
-            # Create temporary dataset file
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv') as tmp:
-                # Create DataFrame with text column
-                df = pd.DataFrame({"text": [text]})
-                
-                # Write to CSV with proper quoting and escaping
-                df.to_csv(tmp.name, index=False, quoting=csv.QUOTE_ALL, escapechar='\\')
-                
-                try:
-                    # Use file path to initialize dataset
-                    dataset = AutolabelDataset(tmp.name, config=config)
-                    
-                    agent = LabelingAgent(config=config, cache=False)
-                    labeled_dataset = agent.run(dataset)
-                    
-                    # Get the label from the labeled dataset
-                    label_column = f"{config['task_name']}_label"
-                    if label_column in labeled_dataset.columns():
-                        label = labeled_dataset.df[label_column].iloc[0]
-                        
-                        # If NO_LABEL is returned, get error information
-                        if label == "NO_LABEL":
-                            error_column = f"{config['task_name']}_error"
-                            if error_column in labeled_dataset.columns():
-                                error_msg = labeled_dataset.df[error_column].iloc[0]
-                                return None, f"Labeling failed: {error_msg}", time.time() - start_time
-                            else:
-                                return None, "Labeling failed: Unknown error", time.time() - start_time
-                        
-                        return label, None, time.time() - start_time
-                    else:
-                        return None, f"Label column not found. Available columns: {labeled_dataset.columns()}", time.time() - start_time
-                        
-                except Exception as e:
-                    return None, f"Labeling error: {str(e)}", time.time() - start_time
-                
-                finally:
-                    # Clean up temporary file
-                    try:
-                        os.unlink(tmp.name)
-                    except:
-                        pass
-    
-    finally:
-        _current_user = None
-        _processing_start_time = None
+        entry = await _get_entry(model_name)
+        return (await entry.label_scored_async([text], logprobs))[0]
+    except Exception as e:
+        return None, f"Labeling error: {str(e)}", None
+
+async def label_texts(texts: List[str], model_name: str = "gpt-4") -> Tuple[List[Tuple[Optional[str], Optional[str]]], float]:
+    """
+    Label several texts as one multi-row run
+    :return: Tuple of (list of (predicted_label, error_message) in input order, processing_time)
+    """
+    if LLM_BACKEND == "autolabel":
+        return await _run_in_executor(_label_many, texts, model_name)
 
-def get_processing_status() -> dict:
-    """Get current processing status"""
+    start_time = time.time()
+    with stage("normalize"):
+        texts = [normalize_text(text) for text in texts]
+    try:
+        entry = await _get_entry(model_name)
+        results = await entry.label_many_async(texts)
+    except Exception as e:
+        results = [(None, f"Labeling error: {str(e)}")] * len(texts)
+    return results, time.time() - start_time
+
+async def _label_micro_batch(model_name: str, texts: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    with stage("normalize"):
+        texts = [normalize_text(text) for text in texts]
+    entry = await _get_entry(model_name)
+    return await entry.label_multi_async(texts)
+
+micro_batcher = MicroBatcher(_label_micro_batch)
+
+async def _get_entry(model_name: str) -> "_AgentEntry":
+    # Building an agent is blocking, so a cold or outdated entry is built in the thread pool
+    if agent_registry.is_warm([model_name]):
+        return agent_registry.get(model_name)
+    with stage("agent_build"):
+        return await _run_in_executor(agent_registry.get, model_name)
+
+async def _run_in_executor(func, *args):
+    # Run in the labeling thread pool with the caller's context, so stage timings reach the request
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), functools.partial(context.run, func, *args))
+
+def _label_many(texts: List[str], model_name: str) -> Tuple[List[Tuple[Optional[str], Optional[str]]], float]:
+    """Blocking labeling through autolabel's own LLM client, runs in the labeling thread pool"""
+    start_time = time.time()
+    with stage("normalize"):
+        texts = [normalize_text(text) for text in texts]
+    try:
+        results = agent_registry.get(model_name).label_many(texts)
+    except Exception as e:
+        results = [(None, f"Labeling error: {str(e)}")] * len(texts)
+    return results, time.time() - start_time
+
+_confidence_calculator = None
+
+def answer_confidence(choice: dict) -> Optional[float]:
+    """Average token probability of a chat completion choice, None if it carries no logprobs"""
+    global _confidence_calculator
+    tokens = (choice.get("logprobs") or {}).get("content")
+    if not tokens:
+        return None
+    if _confidence_calculator is None:
+        from autolabel.confidence import ConfidenceCalculator
+        _confidence_calculator = ConfidenceCalculator("logprob_average")
+    return _confidence_calculator.logprob_average([{token["token"]: token["logprob"]} for token in tokens])
+
+class _AgentEntry:
+    """A LabelingAgent built for one model and taxonomy version"""
+
+    def __init__(self, model_name: str, version: str):
+        from autolabel import LabelingAgent
+        from autolabel.few_shot import ExampleSelectorFactory
+        from autolabel.utils import safe_serialize_to_string
+
+        self.model_name = model_name
+        self.version = version
+        self.config = create_config(model_name)
+        self.agent = LabelingAgent(config=self.config, cache=False, console_output=False)
+        # Answers in the "ids" format are label IDs, mapped back through the same matcher
+        self.codes = label_codes() if PROMPT_FORMAT == "ids" else {}
+        self.matcher = LabelMatcher(self.agent.config.labels_list(), self.codes)
+        self.ids_by_label = {label: code for code, label in self.codes.items()}
+
+        # Same example selection LabelingAgent.run sets up, done once instead of per run
+        seed_examples = self.agent.config.few_shot_example_set()
+        self.seed_examples = [{"text": example["text"], "label": example["label"]} for example in seed_examples]
+        self.example_selector = ExampleSelectorFactory.initialize_selector(
+            self.agent.config,
+            [safe_serialize_to_string(example) for example in seed_examples],
+            ["text"],
+            cache=False,
+        )
+        self._serialize = safe_serialize_to_string
+
+        # The parameters autolabel's client actually sends, minus its own timeout setting
+        self.llm_params = {
+            key: value for key, value in self.agent.llm.model_params.items()
+            if key != "request_timeout"
+        }
+
+    def label(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Label one text with the shared agent
+        :return: Tuple of (predicted_label, error_message)
+        """
+        return self.label_many([text])[0]
+
+    def _build_prompts(self, texts: List[str]) -> Tuple[List[dict], List[str]]:
+        chunks = [{"text": text} for text in texts]
+        prompts = []
+        with stage("prompt_build"):
+            for chunk in chunks:
+                examples = []
+                if FEW_SHOT_STRATEGY == "similar":
+                    with stage("example_select"):
+                        examples = select_examples(chunk["text"], self.seed_examples)
+                    if self.ids_by_label:
+                        examples = [{**example, "label": self.ids_by_label[example["label"]]} for example in examples]
+                elif self.example_selector:
+                    examples = self.example_selector.select_examples(self._serialize(chunk))
+                prompts.append(self.agent.task.construct_prompt(chunk, examples))
+        return chunks, prompts
+
+    def _parse(self, generation: "Generation", chunk: dict, prompt: str) -> Tuple[Optional[str], Optional[str]]:
+        task = self.agent.task
+        with stage("parse"):
+            # Exact answers and their variants (case, punctuation, truncation) map straight to a label,
+            # autolabel's parser only runs for answers that match nothing, to report why
+            predicted_label = self.matcher.match(generation.text)
+            if predicted_label is None:
+                annotation = task.parse_llm_response(generation, chunk, prompt)
+        if predicted_label is not None:
+            return predicted_label, None
+        if annotation.label == task.NULL_LABEL_TOKEN:
+            NO_LABEL_RESULTS.labels(self.model_name).inc()
+            if annotation.error is not None:
+                return None, f"Labeling failed: {annotation.error}"
+            return None, "Labeling failed: Unknown error"
+        return annotation.label, None
+
+    def label_many(self, texts: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Label several texts with a single multi-prompt call through autolabel's LLM client.
+        LabelingAgent.run keeps per-run state on the agent, so it cannot be shared between
+        threads; this performs the same prompt -> LLM -> parse steps without that state.
+        :return: List of (predicted_label, error_message), in input order
+        """
+        chunks, prompts = self._build_prompts(texts)
+        with stage("llm_call"):
+            response = self.agent.llm.label(prompts)
+        results = []
+        for chunk, prompt, generations, error in zip(chunks, prompts, response.generations, response.errors):
+            if error is not None:
+                results.append((None, f"Labeling failed: {error}"))
+            else:
+                results.append(self._parse(generations[0], chunk, prompt))
+        return results
+
+    async def label_many_async(self, texts: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Label several texts through the shared async OpenAI client, with the same
+        prompt, model parameters and output parsing autolabel uses
+        :return: List of (predicted_label, error_message), in input order
+        """
+        results = await self.label_scored_async(texts, logprobs=False)
+        return [(predicted_label, error_message) for predicted_label, error_message, _ in results]
+
+    async def label_scored_async(self, texts: List[str], logprobs: bool = True) -> List[Tuple[Optional[str], Optional[str], Optional[float]]]:
+        """
+        Like label_many_async, also asking for token logprobs to score each answer
+        :return: List of (predicted_label, error_message, confidence), in input order;
+                 confidence is None when logprobs were not requested or not returned
+        """
+        from langchain.schema import Generation
+
+        chunks, prompts = self._build_prompts(texts)
+        responses = await asyncio.gather(
+            *[self._complete(prompt, logprobs) for prompt in prompts],
+            return_exceptions=True
+        )
+        results = []
+        for chunk, prompt, response in zip(chunks, prompts, responses):
+            if isinstance(response, Exception):
+                results.append((None, f"Labeling failed: {response}", None))
+            else:
+                choice = response["choices"][0]
+                content = choice["message"].get("content") or ""
+                predicted_label, error_message = self._parse(Generation(text=content), chunk, prompt)
+                results.append((predicted_label, error_message, answer_confidence(choice) if logprobs else None))
+        return results
+
+    def _build_multi_prompt(self, texts: List[str]) -> str:
+        task = self.agent.task
+        labels_list = self.agent.config.labels_list()
+        guidelines = task.task_guidelines.format(num_labels=len(labels_list), labels="\n".join(labels_list))
+        # The one-label-per-response rule is replaced by the numbered output format
+        guidelines = guidelines.replace(SINGLE_LABEL_INSTRUCTION, "").replace(SINGLE_ID_INSTRUCTION, "").rstrip()
+        numbered = "\n".join(f"{i}: {text}" for i, text in enumerate(texts, start=1))
+        output_format = MULTI_ITEM_ID_OUTPUT_GUIDELINES if self.codes else MULTI_ITEM_OUTPUT_GUIDELINES
+        output_guidelines = output_format.format(count=len(texts))
+        return f"{guidelines}\n\n{output_guidelines}\n\nTexts:\n{numbered}\n\nLabels:"
+
+    def _parse_multi(self, content: str, count: int) -> List[Optional[str]]:
+        by_number = {}
+        for line in content.splitlines():
+            match = _NUMBERED_LINE.match(line)
+            if match is None:
+                continue
+            label = self.matcher.match(match.group(2))
+            if label is not None:
+                by_number.setdefault(int(match.group(1)), label)
+        return [by_number.get(number) for number in range(1, count + 1)]
+
+    async def label_multi_async(self, texts: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Label several texts with one multi-item prompt, sharing the guidelines and
+        label descriptions between them. Texts whose line is missing or not a known
+        label are labeled again one by one with label_many_async.
+        :return: List of (predicted_label, error_message), in input order
+        """
+        if len(texts) == 1:
+            return await self.label_many_async(texts)
+        with stage("prompt_build"):
+            prompt = self._build_multi_prompt(texts)
+        try:
+            response = await self._complete(prompt)
+        except Exception as e:
+            return [(None, f"Labeling failed: {e}")] * len(texts)
+        content = response["choices"][0]["message"].get("content") or ""
+        with stage("parse"):
+            labels = self._parse_multi(content, len(texts))
+
+        results = [(label, None) for label in labels]
+        missing = [i for i, label in enumerate(labels) if label is None]
+        if missing:
+            logger.info(f"Multi-item response left {len(missing)} of {len(texts)} texts unlabeled, retrying them singly")
+            retried = await self.label_many_async([texts[i] for i in missing])
+            for i, result in zip(missing, retried):
+                results[i] = result
+        return results
+
+    async def _complete(self, prompt: str, logprobs: bool = False) -> dict:
+        params = {**self.llm_params, "logprobs": True} if logprobs else self.llm_params
+        # autolabel sends the whole prompt as a single human message
+        with stage("llm_call"):
+            return await openai_client.chat_completion(
+                self.model_name,
+                [{"role": "user", "content": prompt}],
+                **params
+            )
+
+class AgentRegistry:
+    """
+    Warm LabelingAgents keyed by model name, shared by all labeling threads.
+    An agent is rebuilt the next time it is requested after the taxonomy changes.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _AgentEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str) -> _AgentEntry:
+        version = taxonomy_version()
+        entry = self._entries.get(model_name)
+        if entry is not None and entry.version == version:
+            return entry
+        with self._lock:
+            entry = self._entries.get(model_name)
+            if entry is None or entry.version != version:
+                entry = _AgentEntry(model_name, version)
+                self._entries[model_name] = entry
+        return entry
+
+    def warm(self, model_names: List[str] = SUPPORTED_MODELS):
+        """Build the agents for the given models ahead of the first request"""
+        for model_name in model_names:
+            self.get(model_name)
+
+    def is_warm(self, model_names: List[str] = SUPPORTED_MODELS) -> bool:
+        version = taxonomy_version()
+        return all(
+            model_name in self._entries and self._entries[model_name].version == version
+            for model_name in model_names
+        )
+
+agent_registry = AgentRegistry()
+
+async def warm_agents():
+    """Prebuild the agent registry in the labeling thread pool"""
+    try:
+        await _run_in_executor(agent_registry.warm)
+    except Exception as e:
+        # Not fatal, agents are built on first use instead
+        logger.warning(f"Could not prebuild labeling agents: {e}")
+
+_warmup_task: Optional[asyncio.Task] = None
+
+def start_warmup():
+    """Run warm_agents in the background, so the server starts listening before autolabel is imported"""
+    global _warmup_task
+    if _warmup_task is None:
+        _warmup_task = asyncio.create_task(warm_agents())
+
+async def stop_warmup():
+    """Wait for a warm-up still in progress, its agent build cannot be interrupted"""
+    global _warmup_task
+    if _warmup_task is not None:
+        await _warmup_task
+        _warmup_task = None
+
+def warmup_status() -> dict:
+    """Readiness of the labeling agents, see /ready"""
     return {
-        "is_busy": _processing_lock.locked(),
-        "current_user": _current_user,
-        "processing_time": time.time() - _processing_start_time if _processing_start_time else 0
-    } 
\ No newline at end of file
+        "warming": _warmup_task is not None and not _warmup_task.done(),
+        "agents_warm": agent_registry.is_warm(),
+    }
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LABEL_EXECUTOR_WORKERS, thread_name_prefix="labeling")
+    return _executor
+
+def shutdown_executor():
+    """Wait for in-flight labeling calls and stop the thread pool"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, select, func
+
+from .models import RequestLog, engine
+from .analytics import commit_with_rollups
+from .metrics import stage
+from .coordination import COORDINATION_BACKEND, reserve_id_block
+
+logger = logging.getLogger(__name__)
+
+# Log writer settings
+LOG_WRITER_BUFFER_SIZE = int(os.getenv("LOG_WRITER_BUFFER_SIZE", "10000"))
+LOG_WRITER_BATCH_SIZE = int(os.getenv("LOG_WRITER_BATCH_SIZE", "500"))
+LOG_WRITER_FLUSH_INTERVAL_MS = float(os.getenv("LOG_WRITER_FLUSH_INTERVAL_MS", "200"))
+# "buffered" answers before the row is committed (rows still in the buffer are lost on a crash),
+# "sync" waits until the batch holding the row has been committed
+LOG_DURABILITY = os.getenv("LOG_DURABILITY", "buffered").lower()
+# RequestLog ids reserved from the database sequence at a time (Postgres)
+REQUEST_ID_BLOCK_SIZE = int(os.getenv("REQUEST_ID_BLOCK_SIZE", "100"))
+
+FLUSH_ATTEMPTS = 3
+
+
+class LogWriteError(Exception):
+    """Raised to a "sync" durability writer whose row could not be committed"""
+
+
+class RequestIdAllocator:
+    """
+    Hands out RequestLog ids without an insert round-trip, so a request knows
+    its id before its row is written.
+
+    On SQLite ids come from an in-process counter seeded with the highest id in
+    the table (this process must be the only writer), or with the "database"
+    coordination backend from blocks of a counter shared by all processes. On
+    other databases blocks of ids are reserved from the table's sequence, which
+    is safe across instances.
+    """
+
+    def __init__(self, block_size: int = REQUEST_ID_BLOCK_SIZE):
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._ids: Deque[int] = deque()
+        self._first: Optional[int] = None
+        self._last = 0
+
+    def _reserve(self) -> List[int]:
+        if engine.dialect.name == "sqlite" and COORDINATION_BACKEND == "database":
+            return reserve_id_block("requestlog", self.block_size)
+        if engine.dialect.name == "sqlite" and self._first is not None:
+            return list(range(self._last + 1, self._last + 1 + self.block_size))
+        with Session(engine) as session:
+            if engine.dialect.name == "sqlite":
+                last = session.exec(select(func.max(RequestLog.id))).first() or 0
+                return list(range(last + 1, last + 1 + self.block_size))
+            return list(session.exec(
+                text("SELECT nextval(pg_get_serial_sequence('requestlog', 'id')) FROM generate_series(1, :n)"),
+                params={"n": self.block_size}
+            ).scalars())
+
+    def next_id(self) -> int:
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(self._reserve())
+            request_id = self._ids.popleft()
+            if self._first is None:
+                self._first = request_id
+            self._last = max(self._last, request_id)
+            return request_id
+
+    def issued_since_start(self, request_id: int) -> bool:
+        """Whether request_id may have been allocated by this process (its row may still be buffered)"""
+        return self._first is not None and self._first <= request_id <= self._last
+
+
+class LogWriter:
+    """
+    Buffers RequestLog/FeedbackLog rows in a bounded queue and inserts them in
+    batched transactions from a background task, off the request path.
+    A full buffer makes writers wait instead of growing memory.
+    """
+
+    def __init__(self, buffer_size: int = LOG_WRITER_BUFFER_SIZE, batch_size: int = LOG_WRITER_BATCH_SIZE,
+                 flush_interval_ms: float = LOG_WRITER_FLUSH_INTERVAL_MS, durability: str = LOG_DURABILITY):
+        self.buffer_size = max(1, buffer_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.durability = durability
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+    async def start(self):
+        """Start the background flush task"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.buffer_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still buffered and stop the flush task"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+
+    async def write(self, row: SQLModel):
+        """
+        Queue a row for insertion; in "sync" durability mode, return once it is committed
+        :raises LogWriteError: in "sync" durability mode, if the row was dropped
+        """
+        with stage("log_write"):
+            if self._task is None:
+                # Not running inside the app (or already stopped), write directly
+                await asyncio.to_thread(self._insert, [row])
+                return
+            done = asyncio.get_running_loop().create_future() if self.durability == "sync" else None
+            await self._queue.put((row, done))
+            if done is not None:
+                await done
+
+    async def flush(self):
+        """Wait until every row queued so far has been written"""
+        if self._task is None:
+            return
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((None, done))
+        await done
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1][0] is not None:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Tuple[Optional[SQLModel], Optional[asyncio.Future]]]):
+        rows = [row for row, _ in batch if row is not None]
+        error = None
+        for attempt in range(FLUSH_ATTEMPTS):
+            try:
+                if rows:
+                    await asyncio.to_thread(self._insert, rows)
+                    self.written += len(rows)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                logger.warning(f"Writing {len(rows)} log rows failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        failed: List[SQLModel] = []
+        if error is not None:
+            # Usually one bad row fails the whole batch, write the rest without it
+            failed = await asyncio.to_thread(self._insert_bisecting, rows)
+            self.written += len(rows) - len(failed)
+            self.dropped += len(failed)
+        failed_rows = {id(row) for row in failed}
+        for row, done in batch:
+            if done is None or done.done():
+                continue
+            if id(row) in failed_rows:
+                done.set_exception(LogWriteError(f"Log row could not be written: {error}"))
+            else:
+                done.set_result(None)
+
+    def _insert(self, rows: List[SQLModel]):
+        with stage("db_write"), Session(engine, expire_on_commit=False) as session:
+            session.add_all(rows)
+            commit_with_rollups(session, rows)
+
+    def _insert_bisecting(self, rows: List[SQLModel]) -> List[SQLModel]:
+        """Insert rows in halves down to single rows, dropping only the rows that fail; returns the dropped rows"""
+        try:
+            self._insert(rows)
+            return []
+        except Exception as e:
+            if len(rows) == 1:
+                logger.error(f"Dropped log row {rows[0]!r} after {FLUSH_ATTEMPTS} attempts: {e}")
+                return rows
+        middle = len(rows) // 2
+        return self._insert_bisecting(rows[:middle]) + self._insert_bisecting(rows[middle:])
+
+    def status(self) -> dict:
+        """Buffer state and row counts since process start"""
+        return {
+            "durability": self.durability,
+            "buffered": self._queue.qsize() if self._queue is not None else 0,
+            "buffer_size": self.buffer_size,
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+
+request_ids = RequestIdAllocator()
+log_writer = LogWriter()
@@ -1,17 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Header
+from fastapi import FastAPI, HTTPException, Depends, status, Header, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List, Dict, NamedTuple
+from datetime import datetime
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 from sqlmodel import Session
 
-from .models import RequestLog, FeedbackLog, create_db_and_tables, get_session
+from .models import RequestLog, FeedbackLog, LabelJob, create_db_and_tables, get_session
 from .auth import create_access_token, verify_token
-from .accounts import verify_account, get_account_id
-from .labeling import get_label, get_processing_status, LABELS
+from .accounts import verify_account, get_account_id, seed_accounts
+from .labeling import (
+    get_label, get_routed_label, start_warmup, stop_warmup, warmup_status, shutdown_executor, normalize_text,
+    LABELS, SUPPORTED_MODELS, AUTO_MODEL, ROUTING_PRIMARY_MODEL, PROMPT_FORMAT
+)
+from .scheduler import scheduler, QueueFullError
+from .cache import prediction_cache
+from .openai_client import openai_client
+from .batch import label_batch, stream_batch, parse_batch_file, BatchInputError, BATCH_MAX_ROWS
+from .jobs import job_manager, JOB_MAX_ROWS
+from .log_writer import log_writer, request_ids, LogWriteError
+from .coordination import coordinator, startup_lock
+from .feedback_index import feedback_index
+from .singleflight import SingleFlight
+from .events import status_broadcaster, use_progress, sse_event
+from .analytics import backfill_rollups, query_analytics, logs_summary, request_totals
+from .export import export_logs, sqlite_snapshot, LogFilters, ExportError, EXPORT_FORMATS
+from .metrics import (
+    ServerTimingMiddleware, LABEL_RESULTS, LABEL_REQUEST_SECONDS, COALESCED_REQUESTS,
+    stage, label_outcome, bind_status, render_metrics, use_usage, reset_usage, current_timings
+)
 
 load_dotenv()
 
@@ -34,12 +58,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Server-Timing"],
 )
 
-# Initialize database
+# Per-stage timing breakdown in a Server-Timing response header (SERVER_TIMING_ENABLED)
+app.add_middleware(ServerTimingMiddleware)
+
+# Concurrent /label requests for the same normalized text and model share one model call
+label_flights = SingleFlight()
+
+# Initialize database and labeling workers
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    # Worker processes start together, only one at a time may create tables and backfill
+    with startup_lock():
+        create_db_and_tables()
+        seed_accounts()
+        backfill_rollups()
+    prediction_cache.load()
+    await prediction_cache.start()
+    await log_writer.start()
+    await scheduler.start()
+    await coordinator.start(scheduler.status)
+    # Agents (and autolabel's imports) are built after the server starts listening, see /ready
+    start_warmup()
+    await feedback_index.start()
+    job_manager.resume_incomplete()
+    bind_status(scheduler, log_writer)
+    await status_broadcaster.start(_cluster_status)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await status_broadcaster.stop()
+    await scheduler.stop()
+    await job_manager.stop()
+    await feedback_index.stop()
+    await coordinator.stop()
+    await log_writer.stop()
+    await prediction_cache.stop()
+    await openai_client.close()
+    await stop_warmup()
+    shutdown_executor()
 
 # Pydantic models
 class LoginRequest(BaseModel):
@@ -62,6 +121,18 @@ class LabelResponse(BaseModel):
     predicted_label: Optional[str]
     processing_time: float
     error_message: Optional[str] = None
+    cache_hit: bool = False
+    knn_hit: bool = False
+    routed_model: Optional[str] = None
+    routing_confidence: Optional[float] = None
+    escalated: bool = False
+    coalesced: bool = False
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+class BatchLabelRequest(BaseModel):
+    texts: List[str]
+    model_name: str = "gpt-4"
 
 class FeedbackRequest(BaseModel):
     request_id: int
@@ -70,14 +141,26 @@ class FeedbackRequest(BaseModel):
 
 class StatusResponse(BaseModel):
     is_busy: bool
-    current_user: Optional[str]
+    queue_depth: int
+    queue_capacity: int
+    active_workers: int
+    max_workers: int
+    in_flight_users: List[str]
     processing_time: float
+    processes: int = 1
+    global_in_flight: int = 0
+    global_concurrency: int = 0
+    rate_limits: Dict[str, dict] = {}
+
+class CurrentAccount(NamedTuple):
+    username: str
+    account_id: str
 
 # Security
 security = HTTPBearer()
 
-def get_current_user(authorization: str = Header(None)) -> str:
-    """Get current user from JWT token"""
+async def get_current_account(authorization: str = Header(None)) -> CurrentAccount:
+    """Resolve the user and account from the JWT token, once per request"""
     if not authorization:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,23 +171,32 @@ def get_current_user(authorization: str = Header(None)) -> str:
         # Extract token from "Bearer <token>"
         token = authorization.split(" ")[1] if authorization.startswith("Bearer ") else authorization
         payload = verify_token(token)
-        return payload.get("sub")
     except (IndexError, AttributeError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authorization format"
         )
+    
+    username = payload.get("sub")
+    # Tokens carry the account id since login puts it there, no lookup needed
+    account_id = payload.get("account_id") or get_account_id(username)
+    return CurrentAccount(username=username, account_id=account_id)
+
+async def get_current_user(account: CurrentAccount = Depends(get_current_account)) -> str:
+    """Get current user from JWT token"""
+    return account.username
 
 @app.post("/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     """Authenticate user and return JWT token"""
-    if not verify_account(request.username, request.password):
+    # The password hash is deliberately slow, keep it off the event loop
+    account_id = await asyncio.to_thread(verify_account, request.username, request.password)
+    if account_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
         )
     
-    account_id = get_account_id(request.username)
     access_token = create_access_token(data={"sub": request.username, "account_id": account_id})
     
     return LoginResponse(
@@ -115,23 +207,74 @@ async def login(request: LoginRequest):
 
 @app.get("/status", response_model=StatusResponse)
 async def get_status():
-    """Get current processing status"""
-    status_info = get_processing_status()
-    return StatusResponse(**status_info)
+    """Get current queue and worker status, summed over all worker processes"""
+    return StatusResponse(**await _cluster_status())
+
+@app.get("/status/stream")
+async def stream_status():
+    """The /status payload as Server-Sent Events, pushed whenever it changes"""
+    return StreamingResponse(status_broadcaster.stream(), media_type="text/event-stream")
+
+async def _cluster_status() -> dict:
+    status_info = await coordinator.cluster_status()
+    status_info["rate_limits"] = openai_client.status()
+    return status_info
 
 @app.post("/label", response_model=LabelResponse)
 async def label_text(
     request: LabelRequest,
-    current_user: str = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    account: CurrentAccount = Depends(get_current_account)
 ):
     """Label text using AI model"""
-    
+    _validate_label_request(request)
+    return await _label(request, account)
+
+@app.post("/label/stream")
+async def label_text_stream(
+    request: LabelRequest,
+    account: CurrentAccount = Depends(get_current_account)
+):
+    """Label text like /label, streaming queued (with queue position), started and result events as SSE"""
+    _validate_label_request(request)
+    return StreamingResponse(_label_events(request, account), media_type="text/event-stream")
+
+async def _label_events(request: LabelRequest, account: CurrentAccount) -> AsyncIterator[str]:
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run() -> LabelResponse:
+        # The scheduler reports this request's queue position and start through the listener
+        use_progress(lambda event, data: events.put_nowait((event, data)))
+        return await _label(request, account)
+
+    task = asyncio.create_task(run())
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while (item := await events.get()) is not None:
+            yield sse_event(*item)
+        try:
+            response = task.result()
+        except HTTPException as e:
+            error = {"status_code": e.status_code, "detail": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+            yield sse_event("error", error)
+        else:
+            result = jsonable_encoder(response)
+            # The Server-Timing header went out with the first event, the stages are reported here instead
+            timings = current_timings()
+            if timings is not None:
+                result["timings"] = {name: round(seconds * 1000, 1) for name, seconds in timings.items()}
+            yield sse_event("result", result)
+    finally:
+        # Still running only if the client went away, then it stops waiting for a worker
+        task.cancel()
+
+def _validate_label_request(request: LabelRequest):
     # Validate model name
-    if request.model_name not in ["gpt-4", "gpt-3.5-turbo"]:
+    if request.model_name not in SUPPORTED_MODELS and request.model_name != AUTO_MODEL:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Model must be either 'gpt-4' or 'gpt-3.5-turbo'"
+            detail="Model must be 'gpt-4', 'gpt-3.5-turbo' or 'auto'"
         )
     
     # Check if OpenAI API key is set
@@ -140,40 +283,88 @@ async def label_text(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="OpenAI API key not configured"
         )
+
+async def _label(request: LabelRequest, account: CurrentAccount) -> LabelResponse:
+    """Label one text and log the request"""
+    account_id = account.account_id
+    request_start = time.perf_counter()
     
-    account_id = get_account_id(current_user)
-    
-    # Create request log entry
+    # Create request log entry, it is written by the log writer once the request is done
     request_log = RequestLog(
+        id=request_ids.next_id(),
         account_id=account_id,
         model_name=request.model_name,
         input_text=request.text
     )
-    session.add(request_log)
-    session.commit()
-    session.refresh(request_log)
+    # Token usage of the OpenAI calls made for this request, added up by the OpenAI client
+    usage: Dict[str, int] = {}
+    usage_token = use_usage(usage)
     
     try:
-        # Get label prediction
-        predicted_label, error_message, processing_time = await get_label(
-            request.text, 
-            request.model_name, 
-            account_id
-        )
+        # Serve repeated texts from the prediction cache without calling the model
+        start_time = time.time()
+        with stage("cache_lookup"):
+            cached_label = prediction_cache.get(request.text, request.model_name)
+        knn_match = None
+        if cached_label is None and feedback_index.classify_enabled:
+            # Texts close to ones users already confirmed or corrected are labeled by their neighbours
+            with stage("knn_lookup"):
+                knn_match = feedback_index.classify(request.text)
+        if cached_label is not None:
+            predicted_label, error_message = cached_label, None
+            processing_time = time.time() - start_time
+            request_log.cache_hit = True
+        elif knn_match is not None:
+            predicted_label, error_message = knn_match[0], None
+            processing_time = time.time() - start_time
+            request_log.knn_hit = True
+        elif request.model_name == AUTO_MODEL:
+            # Cheaper model first, escalated when its answer is invalid or not confident enough
+            (predicted_label, error_message, processing_time, routed_model, confidence), coalesced = await label_flights.do(
+                (normalize_text(request.text), request.model_name),
+                scheduler.submit,
+                account_id,
+                get_routed_label,
+                request.text,
+                account_id
+            )
+            request_log.routed_model = routed_model
+            request_log.routing_confidence = confidence
+            request_log.escalated = routed_model != ROUTING_PRIMARY_MODEL
+            request_log.coalesced = coalesced
+        else:
+            # Get label prediction from the worker pool, or from an identical request already waiting for it
+            (predicted_label, error_message, processing_time), coalesced = await label_flights.do(
+                (normalize_text(request.text), request.model_name),
+                scheduler.submit,
+                account_id,
+                get_label,
+                request.text, 
+                request.model_name, 
+                account_id
+            )
+            request_log.coalesced = coalesced
+        if request_log.coalesced:
+            # Report the time this request waited, not the time of the call it joined
+            processing_time = time.time() - start_time
+            COALESCED_REQUESTS.labels(request.model_name).inc()
+        elif not request_log.cache_hit and not request_log.knn_hit:
+            if predicted_label is not None:
+                prediction_cache.put(request.text, request.model_name, predicted_label)
+            request_log.prompt_format = PROMPT_FORMAT
+            request_log.prompt_tokens = usage.get("prompt_tokens")
+            request_log.completion_tokens = usage.get("completion_tokens")
         
         # Update request log
         request_log.predicted_label = predicted_label
         request_log.error_message = error_message
         request_log.processing_time = processing_time
-        session.add(request_log)
-        session.commit()
-        
-        # If system is busy, return 423 status
-        if error_message and "busy" in error_message.lower():
-            raise HTTPException(
-                status_code=status.HTTP_423_LOCKED,
-                detail=error_message
-            )
+        await log_writer.write(request_log)
+        _observe_label(
+            request.model_name,
+            label_outcome(predicted_label, request_log.cache_hit, request_log.knn_hit),
+            request_start
+        )
         
         return LabelResponse(
             id=request_log.id,
@@ -181,34 +372,214 @@ async def label_text(
             model_name=request.model_name,
             predicted_label=predicted_label,
             processing_time=processing_time,
-            error_message=error_message
+            error_message=error_message,
+            cache_hit=request_log.cache_hit,
+            knn_hit=request_log.knn_hit,
+            routed_model=request_log.routed_model,
+            routing_confidence=request_log.routing_confidence,
+            escalated=request_log.escalated,
+            coalesced=request_log.coalesced,
+            prompt_tokens=request_log.prompt_tokens,
+            completion_tokens=request_log.completion_tokens
         )
         
+    except QueueFullError as e:
+        # Queue is full, ask the client to back off
+        request_log.error_message = str(e)
+        await log_writer.write(request_log)
+        _observe_label(request.model_name, "rejected", request_start)
+        
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except HTTPException:
         raise
+    except LogWriteError as e:
+        # The request row itself could not be committed, its id must not be handed out
+        _observe_label(request.model_name, "error", request_start)
+        
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
     except Exception as e:
         # Update request log with error
         request_log.error_message = str(e)
-        session.add(request_log)
-        session.commit()
+        await log_writer.write(request_log)
+        _observe_label(request.model_name, "error", request_start)
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        reset_usage(usage_token)
+
+def _observe_label(model_name: str, outcome: str, request_start: float):
+    LABEL_RESULTS.labels("label", model_name, outcome).inc()
+    LABEL_REQUEST_SECONDS.labels(model_name, outcome).observe(time.perf_counter() - request_start)
+
+def _validate_batch(texts: List[str], model_name: str, max_rows: int):
+    """Validate the rows and model of a batch or job"""
+    if model_name not in SUPPORTED_MODELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Model must be either 'gpt-4' or 'gpt-3.5-turbo'"
+        )
+    
+    if not texts:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch is empty"
+        )
+    
+    if len(texts) > max_rows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch is limited to {max_rows} rows"
+        )
+    
+    if not os.getenv("OPENAI_API_KEY"):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="OpenAI API key not configured"
+        )
+
+async def _read_batch_file(file: UploadFile) -> List[str]:
+    try:
+        return parse_batch_file(file.filename, await file.read())
+    except BatchInputError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+def _start_batch(texts: List[str], model_name: str, account: CurrentAccount, stream_format: str) -> StreamingResponse:
+    """Validate a batch and stream its results"""
+    if stream_format not in ("ndjson", "sse"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Format must be either 'ndjson' or 'sse'"
+        )
+    _validate_batch(texts, model_name, BATCH_MAX_ROWS)
+    
+    rows = label_batch(texts, model_name, account.account_id)
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream_batch(rows, stream_format), media_type=media_type)
+
+@app.post("/label/batch")
+async def label_batch_texts(
+    request: BatchLabelRequest,
+    format: str = "ndjson",
+    account: CurrentAccount = Depends(get_current_account)
+):
+    """Label a list of texts, streaming per-row results as NDJSON or SSE"""
+    return _start_batch(request.texts, request.model_name, account, format)
+
+@app.post("/label/batch/upload")
+async def label_batch_upload(
+    file: UploadFile = File(...),
+    model_name: str = Form("gpt-4"),
+    format: str = "ndjson",
+    account: CurrentAccount = Depends(get_current_account)
+):
+    """Label the rows of an uploaded CSV ('text' column) or JSONL file, streaming per-row results"""
+    texts = await _read_batch_file(file)
+    return _start_batch(texts, model_name, account, format)
+
+async def _create_job(texts: List[str], model_name: str, account: CurrentAccount) -> dict:
+    _validate_batch(texts, model_name, JOB_MAX_ROWS)
+    job = await job_manager.create_job(texts, model_name, account.account_id)
+    return job_manager.progress(job)
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_job(request: BatchLabelRequest, account: CurrentAccount = Depends(get_current_account)):
+    """Start a background labeling job for a list of texts and return its id immediately"""
+    return await _create_job(request.texts, request.model_name, account)
+
+@app.post("/jobs/upload", status_code=status.HTTP_202_ACCEPTED)
+async def create_job_upload(
+    file: UploadFile = File(...),
+    model_name: str = Form("gpt-4"),
+    account: CurrentAccount = Depends(get_current_account)
+):
+    """Start a background labeling job for an uploaded CSV ('text' column) or JSONL file"""
+    texts = await _read_batch_file(file)
+    return await _create_job(texts, model_name, account)
+
+def _get_own_job(job_id: str, account: CurrentAccount, session: Session) -> LabelJob:
+    """Load a job, only its owner and admin may access it"""
+    job = session.get(LabelJob, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    
+    if account.username != "admin" and job.account_id != account.account_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this job"
+        )
+    return job
+
+@app.get("/jobs")
+async def list_jobs(account: CurrentAccount = Depends(get_current_account), session: Session = Depends(get_session)):
+    """List the current user's jobs, newest first"""
+    from sqlmodel import select
+    
+    query = select(LabelJob).order_by(LabelJob.created_at.desc()).limit(100)
+    if account.username != "admin":
+        query = query.where(LabelJob.account_id == account.account_id)
+    return {"jobs": [job_manager.progress(job) for job in session.exec(query).all()]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, account: CurrentAccount = Depends(get_current_account), session: Session = Depends(get_session)):
+    """Get job progress and ETA"""
+    job = _get_own_job(job_id, account, session)
+    return job_manager.progress(job)
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    account: CurrentAccount = Depends(get_current_account),
+    session: Session = Depends(get_session)
+):
+    """Get a page of job results in input order"""
+    _get_own_job(job_id, account, session)
+    return job_manager.results(session, job_id, offset, limit)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, account: CurrentAccount = Depends(get_current_account), session: Session = Depends(get_session)):
+    """Cancel a queued or running job"""
+    _get_own_job(job_id, account, session)
+    if not await job_manager.cancel(job_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Job has already finished"
+        )
+    return {"status": "success", "message": "Job cancelled"}
 
 @app.post("/feedback")
 async def submit_feedback(
     request: FeedbackRequest,
-    current_user: str = Depends(get_current_user),
+    account: CurrentAccount = Depends(get_current_account),
     session: Session = Depends(get_session)
 ):
     """Submit user feedback on prediction"""
     
-    account_id = get_account_id(current_user)
+    account_id = account.account_id
     
     # Validate that the request exists and belongs to the user
     request_log = session.get(RequestLog, request.request_id)
+    if not request_log and request_ids.issued_since_start(request.request_id):
+        # The request row may still be waiting in the log writer's buffer
+        await log_writer.flush()
+        request_log = session.get(RequestLog, request.request_id)
     if not request_log:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -236,8 +607,14 @@ async def submit_feedback(
         corrected_label=request.corrected_label
     )
     
-    session.add(feedback_log)
-    session.commit()
+    try:
+        await log_writer.write(feedback_log)
+    except LogWriteError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    feedback_index.add_feedback(request_log, request.is_supported, request.corrected_label)
     
     return {"status": "success", "message": "Feedback submitted successfully"}
 
@@ -246,14 +623,32 @@ async def get_labels():
     """Get all available labels"""
     return {"labels": LABELS}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: stage latencies, labeling outcomes, queue and worker gauges"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
     return {"message": "AI Labeling API is running", "status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check, 503 until the labeling agents have been warmed up"""
+    warmup = warmup_status()
+    if warmup["warming"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Labeling agents are warming up"
+        )
+    # A failed warm-up is not fatal, agents are then built on the first request
+    return {"status": "ready" if warmup["agents_warm"] else "degraded", **warmup}
+
 @app.get("/download-logs")
 async def download_logs(current_user: str = Depends(get_current_user)):
-    """Download database logs (admin only)"""
+    """Download a consistent snapshot of the database (admin only)"""
     # Only allow admin to download logs
     if current_user != "admin":
         raise HTTPException(
@@ -261,19 +656,99 @@ async def download_logs(current_user: str = Depends(get_current_user)):
             detail="Only admin can download logs"
         )
     
-    db_path = "app.db"
-    if not os.path.exists(db_path):
+    # Include rows still buffered by the log writer
+    await log_writer.flush()
+    try:
+        snapshot_path = await asyncio.to_thread(sqlite_snapshot)
+    except ExportError as e:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Database file not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
     
     return FileResponse(
-        path=db_path,
+        path=snapshot_path,
         filename="ai_labeling_logs.db",
-        media_type="application/octet-stream"
+        media_type="application/octet-stream",
+        background=BackgroundTask(os.remove, snapshot_path)
+    )
+
+@app.get("/export-logs")
+async def export_logs_file(
+    format: str = "csv",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    account_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+    label: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """Stream request logs joined with their feedback as CSV, JSONL or Parquet (admin only)"""
+    if current_user != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin can export logs"
+        )
+    
+    await log_writer.flush()
+    filters = LogFilters(start=start, end=end, account_id=account_id, model_name=model_name, label=label)
+    try:
+        content = export_logs(format, filters)
+    except ExportError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="ai_labeling_logs.{format}"'}
     )
 
+@app.get("/admin/cache")
+async def get_cache_stats(current_user: str = Depends(get_current_user), session: Session = Depends(get_session)):
+    """Get prediction cache statistics (admin only)"""
+    if current_user != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin can view cache statistics"
+        )
+    
+    # Hit rate over the whole request history, not just since the last restart
+    total_requests, cache_hits = request_totals(session)
+    
+    stats = prediction_cache.stats()
+    stats["logged_requests"] = total_requests
+    stats["logged_cache_hits"] = cache_hits
+    stats["logged_hit_rate"] = cache_hits / total_requests if total_requests else 0.0
+    # In-flight deduplication in this process, the other shortcut around a model call
+    stats["coalescing"] = label_flights.stats()
+    return stats
+
+@app.get("/admin/knn")
+async def get_knn_stats(current_user: str = Depends(get_current_user)):
+    """Get feedback-index pre-classifier size and bypass rate (admin only)"""
+    if current_user != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin can view pre-classifier statistics"
+        )
+    
+    return feedback_index.stats()
+
+@app.delete("/admin/cache")
+async def invalidate_cache(model_name: Optional[str] = None, current_user: str = Depends(get_current_user)):
+    """Invalidate the prediction cache, optionally for a single model (admin only)"""
+    if current_user != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin can invalidate the cache"
+        )
+    
+    removed = await asyncio.to_thread(prediction_cache.invalidate, model_name)
+    return {"status": "success", "removed": removed}
+
 @app.get("/logs-summary")
 async def get_logs_summary(current_user: str = Depends(get_current_user), session: Session = Depends(get_session)):
     """Get summary of logs (admin only)"""
@@ -284,26 +759,33 @@ async def get_logs_summary(current_user: str = Depends(get_current_user), sessio
             detail="Only admin can view logs summary"
         )
     
-    from sqlmodel import select, func
-    
-    # Get request logs count by account
-    request_logs_query = select(RequestLog.account_id, func.count(RequestLog.id).label("count")).group_by(RequestLog.account_id)
-    request_logs_result = session.exec(request_logs_query).all()
-    
-    # Get feedback logs count by account
-    feedback_logs_query = select(FeedbackLog.account_id, func.count(FeedbackLog.id).label("count")).group_by(FeedbackLog.account_id)
-    feedback_logs_result = session.exec(feedback_logs_query).all()
+    # Counts come from the usage rollups instead of scanning the log tables
+    return logs_summary(session)
+
+@app.get("/analytics")
+async def get_analytics(
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    account_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Get time-bucketed latency, error, label and feedback statistics (admin only)"""
+    if current_user != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin can view analytics"
+        )
     
-    # Get total counts
-    total_requests = session.exec(select(func.count(RequestLog.id))).first()
-    total_feedback = session.exec(select(func.count(FeedbackLog.id))).first()
+    if granularity not in ("hour", "day"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Granularity must be either 'hour' or 'day'"
+        )
     
-    return {
-        "total_requests": total_requests,
-        "total_feedback": total_feedback,
-        "requests_by_account": [{"account_id": r[0], "count": r[1]} for r in request_logs_result],
-        "feedback_by_account": [{"account_id": r[0], "count": r[1]} for r in feedback_logs_result]
-    }
+    return query_analytics(session, granularity, start, end, account_id, model_name)
 
 if __name__ == "__main__":
     import uvicorn
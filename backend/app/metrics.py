@@ -0,0 +1,186 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+
+# Adds a Server-Timing header with the per-stage breakdown to every response
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "labeling_stage_seconds",
+    "Time spent in each stage of the labeling pipeline",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+LABEL_REQUEST_SECONDS = Histogram(
+    "label_request_seconds",
+    "End-to-end time of /label requests",
+    ["model_name", "outcome"],
+    buckets=STAGE_BUCKETS
+)
+LABEL_RESULTS = Counter(
+    "label_results_total",
+    "Labeling results by source (label, batch) and outcome (labeled, cache_hit, knn_hit, failed, rejected, error)",
+    ["source", "model_name", "outcome"]
+)
+NO_LABEL_RESULTS = Counter(
+    "label_no_label_total",
+    "Model responses that did not parse to a known label (autolabel's NO_LABEL)",
+    ["model_name"]
+)
+OPENAI_REQUESTS = Counter(
+    "openai_requests_total",
+    "Chat completion HTTP attempts by response status ('network_error' when no response arrived)",
+    ["model_name", "status"]
+)
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Tokens reported in chat completion usage, by kind (prompt, completion)",
+    ["model_name", "kind"]
+)
+KNN_LOOKUPS = Counter(
+    "knn_lookups_total",
+    "Feedback-index pre-classifier lookups by result (hit answers without the LLM, miss, low_confidence)",
+    ["result"]
+)
+ROUTING_DECISIONS = Counter(
+    "label_routing_decisions_total",
+    "model_name=auto routing: accepted from the primary model, escalated_invalid or escalated_low_confidence",
+    ["decision"]
+)
+COALESCED_REQUESTS = Counter(
+    "label_coalesced_total",
+    "/label requests answered by an identical request already in flight instead of their own model call",
+    ["model_name"]
+)
+KNN_INDEX_SIZE = Gauge("knn_index_size", "Labeled texts in the feedback index")
+QUEUE_DEPTH = Gauge("label_queue_depth", "Requests waiting for a labeling worker")
+ACTIVE_WORKERS = Gauge("label_active_workers", "Labeling workers currently processing a request")
+IN_FLIGHT_ACCOUNTS = Gauge("label_in_flight_accounts", "Accounts with a request being processed")
+LOG_BUFFERED = Gauge("log_writer_buffered_rows", "Log rows waiting to be written")
+
+# Stage durations of the request being handled, None outside a request
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+# OpenAI token usage of the request being handled, None outside a request that collects it
+_request_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("request_usage", default=None)
+
+
+def record_stage(stage_name: str, seconds: float):
+    """Observe a stage duration and add it to the current request's breakdown"""
+    STAGE_SECONDS.labels(stage_name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+@contextmanager
+def stage(stage_name: str):
+    """Time a block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, time.perf_counter() - start)
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    """The current request's stage breakdown, to hand over to work running in another task"""
+    return _request_timings.get()
+
+
+def use_timings(timings: Optional[Dict[str, float]]):
+    """Record stages into the given breakdown from now on, in the current task; returns a reset token"""
+    return _request_timings.set(timings)
+
+
+def reset_timings(token):
+    _request_timings.reset(token)
+
+
+def record_usage(model_name: str, usage: dict):
+    """Count a completion's prompt and completion tokens and add them to the current request's usage"""
+    totals = _request_usage.get()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = usage.get(kind)
+        if count is None:
+            continue
+        OPENAI_TOKENS.labels(model_name, kind[:-len("_tokens")]).inc(count)
+        if totals is not None:
+            totals[kind] = totals.get(kind, 0) + count
+
+
+def current_usage() -> Optional[Dict[str, int]]:
+    """The current request's token usage, to hand over to work running in another task"""
+    return _request_usage.get()
+
+
+def use_usage(usage: Optional[Dict[str, int]]):
+    """Add token usage to the given totals from now on, in the current task; returns a reset token"""
+    return _request_usage.set(usage)
+
+
+def reset_usage(token):
+    _request_usage.reset(token)
+
+
+def label_outcome(predicted_label: Optional[str], cache_hit: bool = False, knn_hit: bool = False) -> str:
+    """Outcome label of a finished labeling result"""
+    if cache_hit:
+        return "cache_hit"
+    if knn_hit:
+        return "knn_hit"
+    return "labeled" if predicted_label is not None else "failed"
+
+
+def bind_status(scheduler, log_writer):
+    """Read the gauges from the scheduler and log writer whenever /metrics is scraped"""
+    QUEUE_DEPTH.set_function(lambda: scheduler.status()["queue_depth"])
+    ACTIVE_WORKERS.set_function(lambda: scheduler.status()["active_workers"])
+    IN_FLIGHT_ACCOUNTS.set_function(lambda: len(scheduler.status()["in_flight_users"]))
+    LOG_BUFFERED.set_function(lambda: log_writer.status()["buffered"])
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Exposition text for /metrics, aggregated over worker processes when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware that collects stage timings per request and reports them in a Server-Timing header"""
+
+    def __init__(self, app, enabled: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+                entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.1f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(entries).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = use_timings(timings)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            reset_timings(token)
@@ -1,32 +1,190 @@
 from sqlmodel import SQLModel, Field, create_engine, Session
+from sqlalchemy import Index, event, inspect, literal, text
 from datetime import datetime
 from typing import Optional
 import os
 
 class RequestLog(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_requestlog_account_id_timestamp", "account_id", "timestamp"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     account_id: str
-    model_name: str
+    model_name: str = Field(index=True)
     input_text: str
     predicted_label: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     processing_time: Optional[float] = None
     error_message: Optional[str] = None
+    cache_hit: bool = False
+    knn_hit: bool = False  # answered by the feedback index without calling the model
+    # model_name "auto" only: the model whose answer was used, and the primary model's confidence
+    routed_model: Optional[str] = None
+    routing_confidence: Optional[float] = None
+    escalated: bool = False
+    coalesced: bool = False  # answered by an identical request that was in flight, see singleflight.py
+    # Prompt format used (see labeling.PROMPT_FORMAT) and OpenAI usage summed over the request's calls
+    prompt_format: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
 
 class FeedbackLog(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    request_id: int = Field(foreign_key="requestlog.id")
-    account_id: str
+    request_id: int = Field(foreign_key="requestlog.id", index=True)
+    account_id: str = Field(index=True)
     is_supported: bool
     corrected_label: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
-# Database setup
-DATABASE_URL = "sqlite:///./logs.db"
-engine = create_engine(DATABASE_URL, echo=False)
+class PredictionCache(SQLModel, table=True):
+    cache_key: str = Field(primary_key=True)
+    model_name: str
+    taxonomy_version: str
+    input_text: str
+    predicted_label: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_accessed: datetime = Field(default_factory=datetime.utcnow)
+    hit_count: int = 0
+
+class LabelJob(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    account_id: str
+    model_name: str
+    status: str = "queued"  # queued, running, completed, cancelled, failed
+    total_rows: int
+    completed_rows: int = 0
+    failed_rows: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error_message: Optional[str] = None
+
+class LabelJobItem(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(foreign_key="labeljob.id", index=True)
+    row_index: int
+    input_text: str
+    status: str = "pending"  # pending, done, failed
+    predicted_label: Optional[str] = None
+    error_message: Optional[str] = None
+    processing_time: Optional[float] = None
+    cache_hit: bool = False
+    request_id: Optional[int] = Field(default=None, foreign_key="requestlog.id")
+
+class UsageRollup(SQLModel, table=True):
+    """Hourly request and feedback counters per account, model and predicted label, see analytics.py"""
+    bucket_start: datetime = Field(primary_key=True)
+    account_id: str = Field(primary_key=True)
+    model_name: str = Field(primary_key=True)
+    label: str = Field(primary_key=True)  # predicted label, "" for failed requests
+    requests: int = 0
+    errors: int = 0
+    cache_hits: int = 0
+    escalations: int = 0  # model_name "auto" requests answered by the escalation model
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_sum: float = 0.0
+    latency_histogram: str = "[]"  # JSON counts per analytics.LATENCY_BUCKETS bound
+    feedback: int = 0
+    feedback_supported: int = 0
+    feedback_corrected: int = 0
+
+class Account(SQLModel, table=True):
+    """Login accounts, seeded from accounts.ACCOUNTS on startup"""
+    username: str = Field(primary_key=True)
+    account_id: str
+    password_hash: str  # "pbkdf2_sha256$<iterations>$<salt>$<hex digest>", see accounts.py
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class WorkerProcess(SQLModel, table=True):
+    """Heartbeat and scheduler status of each app process, see coordination.py"""
+    process_id: str = Field(primary_key=True)
+    hostname: str
+    pid: int
+    status: str = "{}"  # JSON of the process's scheduler status
+    started_at: datetime = Field(default_factory=datetime.utcnow)
+    heartbeat_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class WorkerLease(SQLModel, table=True):
+    """One in-flight OpenAI call counted against the global concurrency cap"""
+    lease_id: str = Field(primary_key=True)
+    process_id: str = Field(index=True)
+    model_name: str
+    acquired_at: datetime = Field(default_factory=datetime.utcnow)
+
+class IdSequence(SQLModel, table=True):
+    """Id counters shared by the processes of a multi-worker SQLite deployment, see coordination.py"""
+    name: str = Field(primary_key=True)
+    next_value: int
+
+# Database setup, DATABASE_URL may point at Postgres for multi-instance deployments
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./logs.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the log writer; NORMAL sync is durable across
+        # application crashes and only loses the last commits on power loss
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True
+    )
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    _add_missing_indexes()
+
+def _add_missing_columns():
+    """Add columns introduced after a table was first created, create_all only creates missing tables"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    default = literal(column.default.arg).compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                    ddl += f" DEFAULT {default}"
+                conn.execute(text(ddl))
+
+def _add_missing_indexes():
+    """Create indexes added to tables that already existed, create_all skips existing tables entirely"""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    if engine.dialect.name == "sqlite":
+        # Refresh the query planner statistics for the new indexes
+        with engine.begin() as conn:
+            conn.execute(text("PRAGMA optimize"))
 
 def get_session():
     with Session(engine) as session:
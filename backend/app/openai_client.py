@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from .metrics import stage, record_usage, OPENAI_REQUESTS
+from .coordination import coordinator
+
+logger = logging.getLogger(__name__)
+
+# Client settings, OPENAI_API_BASE can point at a local mock server
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "20"))
+
+# Requests and tokens per minute for each model, 0 disables that limit.
+# Override with e.g. OPENAI_RATE_LIMITS='{"gpt-4": {"rpm": 500, "tpm": 10000}}'
+DEFAULT_RATE_LIMITS = {
+    "gpt-4": {"rpm": 500, "tpm": 40000},
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000},
+}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}"))}
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class OpenAIError(Exception):
+    """Raised when a chat completion fails after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at per_minute / 60 tokens per second"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        """Wait until amount tokens are available and take them; waiters are served in order"""
+        if not self.capacity:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self.blocked_until - time.monotonic()
+                if wait <= 0:
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return
+                    wait = (amount - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def adjust(self, delta: float):
+        """Correct an estimate once the real cost is known (positive delta takes more tokens)"""
+        if not self.capacity:
+            return
+        self._refill()
+        self.tokens = max(-self.capacity, min(self.capacity, self.tokens - delta))
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a while, used when the server says we are rate limited"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def status(self) -> dict:
+        self._refill()
+        return {
+            "limit_per_minute": self.capacity,
+            "available": round(self.tokens, 1),
+            "paused_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+        }
+
+
+class _ModelLimiter:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+
+def estimate_tokens(messages: List[dict], max_tokens: int) -> int:
+    """Rough token count for the TPM budget: ~4 characters per token plus the completion allowance"""
+    chars = sum(len(message.get("content", "")) for message in messages)
+    return chars // 4 + max_tokens
+
+
+class OpenAIClient:
+    """
+    Process-wide async client for the OpenAI chat completions API.
+
+    Holds one pooled keep-alive HTTP connection pool, applies per-model RPM/TPM
+    token buckets before each call and retries 429/5xx responses and network
+    errors with exponential backoff (honouring Retry-After).
+    """
+
+    def __init__(self, api_base: str = OPENAI_API_BASE, timeout: float = OPENAI_TIMEOUT_SECONDS,
+                 max_retries: int = OPENAI_MAX_RETRIES, max_connections: int = OPENAI_MAX_CONNECTIONS):
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._limiters: Dict[str, _ModelLimiter] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+            )
+        return self._client
+
+    def _limiter(self, model_name: str) -> _ModelLimiter:
+        limiter = self._limiters.get(model_name)
+        if limiter is None:
+            limits = RATE_LIMITS.get(model_name, {})
+            limiter = self._limiters[model_name] = _ModelLimiter(limits.get("rpm", 0), limits.get("tpm", 0))
+        return limiter
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), OPENAI_BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass
+        delay = min(OPENAI_BACKOFF_BASE_SECONDS * (2 ** attempt), OPENAI_BACKOFF_MAX_SECONDS)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def chat_completion(self, model_name: str, messages: List[dict], **params) -> dict:
+        """
+        Create a chat completion and return the decoded response body
+        :raises OpenAIError: on a non-retryable error or when retries are exhausted
+        """
+        limiter = self._limiter(model_name)
+        estimated_tokens = estimate_tokens(messages, params.get("max_tokens", 0))
+        with stage("rate_limit_wait"):
+            await limiter.requests.acquire(1)
+            await limiter.tokens.acquire(estimated_tokens)
+        limiter.calls += 1
+
+        headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+        payload = {"model": model_name, "messages": messages, **params}
+        # Counts against the concurrency cap shared by all processes (see coordination.py)
+        lease = await coordinator.acquire(model_name)
+        try:
+            last_error = "unknown error"
+            status_code = None
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    limiter.retries += 1
+                try:
+                    response = await self._get_client().post("/chat/completions", json=payload, headers=headers)
+                except httpx.HTTPError as e:
+                    OPENAI_REQUESTS.labels(model_name, "network_error").inc()
+                    last_error, status_code = f"{type(e).__name__}: {e}", None
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+
+                OPENAI_REQUESTS.labels(model_name, str(response.status_code)).inc()
+                if response.status_code == 200:
+                    body = response.json()
+                    usage = body.get("usage") or {}
+                    record_usage(model_name, usage)
+                    if "total_tokens" in usage:
+                        limiter.tokens.adjust(usage["total_tokens"] - estimated_tokens)
+                    return body
+
+                status_code = response.status_code
+                last_error = f"HTTP {status_code}: {response.text[:500]}"
+                if status_code not in RETRY_STATUS_CODES:
+                    break
+                delay = self._backoff(attempt, response.headers.get("retry-after"))
+                if status_code == 429:
+                    # Hold back every caller of this model, not just this one
+                    limiter.rate_limited += 1
+                    limiter.requests.pause(delay)
+                logger.warning(f"OpenAI {model_name} call failed ({last_error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+            limiter.failures += 1
+            raise OpenAIError(f"OpenAI request failed: {last_error}", status_code)
+        finally:
+            await coordinator.release(lease)
+
+    def status(self) -> Dict[str, dict]:
+        """Rate-limit state per model"""
+        return {
+            model_name: {
+                "requests": limiter.requests.status(),
+                "tokens": limiter.tokens.status(),
+                "calls": limiter.calls,
+                "retries": limiter.retries,
+                "rate_limited": limiter.rate_limited,
+                "failures": limiter.failures,
+            }
+            for model_name, limiter in self._limiters.items()
+        }
+
+    async def close(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._limiters = {}
+
+
+openai_client = OpenAIClient()
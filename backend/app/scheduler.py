@@ -0,0 +1,211 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from .metrics import current_timings, use_timings, reset_timings, record_stage, current_usage, use_usage, reset_usage
+from .events import current_progress
+
+# Scheduler settings
+LABEL_WORKERS = int(os.getenv("LABEL_WORKERS", "4"))
+LABEL_QUEUE_SIZE = int(os.getenv("LABEL_QUEUE_SIZE", "32"))
+LABEL_QUEUE_PER_ACCOUNT = int(os.getenv("LABEL_QUEUE_PER_ACCOUNT", str(LABEL_QUEUE_SIZE)))
+
+# Initial guess for how long one labeling call takes, refined as calls complete
+DEFAULT_SERVICE_TIME = 5.0
+
+
+class QueueFullError(Exception):
+    """Raised when a request cannot be queued; carries a Retry-After hint in seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Job:
+    def __init__(self, account_id: str, func: Callable[..., Awaitable[Any]], args: tuple):
+        self.account_id = account_id
+        self.func = func
+        self.args = args
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        # The submitting request's stage timings, so the worker's stages show up in its breakdown
+        self.timings = current_timings()
+        self.usage = current_usage()
+        # Listener for queue position and start events (POST /label/stream), and the position last sent
+        self.progress = current_progress()
+        self.position: Optional[int] = None
+
+
+class LabelScheduler:
+    """
+    Bounded worker pool for labeling requests.
+
+    Pending jobs are kept in one FIFO queue per account and workers take jobs
+    from the accounts in round-robin order, so a single account submitting many
+    requests cannot starve the others.
+    """
+
+    def __init__(self, max_workers: int = LABEL_WORKERS, max_queue_size: int = LABEL_QUEUE_SIZE,
+                 max_queue_per_account: int = LABEL_QUEUE_PER_ACCOUNT):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self.max_queue_per_account = max(1, max_queue_per_account)
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._queue_depth = 0
+        self._in_flight: Dict[int, _Job] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._service_time = DEFAULT_SERVICE_TIME
+
+    async def start(self):
+        """Start the worker tasks"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_workers)]
+
+    async def stop(self):
+        """Stop the workers and fail any request still waiting in the queue"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(RuntimeError("Server is shutting down"))
+        self._queues.clear()
+        self._queue_depth = 0
+
+    def retry_after(self) -> int:
+        """Estimate how many seconds until a queue slot frees up"""
+        backlog = self._queue_depth + len(self._in_flight)
+        return max(1, int(round(backlog / self.max_workers * self._service_time)))
+
+    async def submit(self, account_id: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """
+        Queue func(*args) for execution by a worker and wait for its result
+        :raises QueueFullError: if the global or per-account queue is full
+        """
+        if not self._workers:
+            await self.start()
+
+        idle_workers = self.max_workers - len(self._in_flight)
+        if self._queue_depth - idle_workers >= self.max_queue_size:
+            raise QueueFullError(
+                "Labeling queue is full. Please retry later, or submit large runs as a job via POST /jobs.",
+                self.retry_after()
+            )
+
+        account_queue = self._queues.get(account_id)
+        if account_queue is not None and len(account_queue) >= self.max_queue_per_account:
+            raise QueueFullError(
+                f"Account '{account_id}' already has {len(account_queue)} queued requests. Please retry later.",
+                self.retry_after()
+            )
+
+        job = _Job(account_id, func, args)
+        async with self._wakeup:
+            if account_queue is None:
+                account_queue = self._queues[account_id] = deque()
+            account_queue.append(job)
+            self._queue_depth += 1
+            self._report_positions()
+            self._wakeup.notify()
+
+        return await job.future
+
+    def _next_job(self) -> Optional[_Job]:
+        # Take the oldest job of the account at the head of the rotation,
+        # then move that account to the back so the others get a turn
+        while self._queues:
+            account_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            self._queue_depth -= 1
+            if queue:
+                self._queues.move_to_end(account_id)
+            else:
+                del self._queues[account_id]
+            # Skip requests whose caller has already gone away
+            if not job.future.cancelled():
+                return job
+        return None
+
+    async def _worker(self, worker_id: int):
+        while True:
+            async with self._wakeup:
+                job = self._next_job()
+                while job is None:
+                    await self._wakeup.wait()
+                    job = self._next_job()
+
+            self._in_flight[worker_id] = job
+            job.started_at = time.time()
+            if job.progress is not None:
+                job.progress("started", {"queue_wait": job.started_at - job.enqueued_at})
+            self._report_positions()
+            token = use_timings(job.timings)
+            usage_token = use_usage(job.usage)
+            record_stage("queue_wait", job.started_at - job.enqueued_at)
+            try:
+                result = await job.func(*job.args)
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                reset_usage(usage_token)
+                reset_timings(token)
+                del self._in_flight[worker_id]
+                # Exponentially weighted average of the service time for Retry-After
+                self._service_time = 0.8 * self._service_time + 0.2 * (time.time() - job.started_at)
+
+    def _position(self, job: _Job) -> int:
+        """1-based place of a queued job in the round-robin order, assuming nothing else is queued meanwhile"""
+        accounts = list(self._queues)
+        own = accounts.index(job.account_id)
+        index = self._queues[job.account_id].index(job)
+        ahead = index
+        for i, account_id in enumerate(accounts):
+            if i != own:
+                # Accounts before this one in the rotation get one more turn before it comes up
+                ahead += min(len(self._queues[account_id]), index + (1 if i < own else 0))
+        return ahead + 1
+
+    def _report_positions(self):
+        """Send queued jobs with a progress listener their place in the queue when it changed"""
+        for queue in self._queues.values():
+            for job in queue:
+                if job.progress is None or job.future.done():
+                    continue
+                position = self._position(job)
+                if position != job.position:
+                    job.position = position
+                    job.progress("queued", {"position": position, "queue_depth": self._queue_depth})
+
+    def status(self) -> dict:
+        """Get current queue and worker status"""
+        now = time.time()
+        in_flight = list(self._in_flight.values())
+        oldest_start = min((job.started_at for job in in_flight), default=None)
+        return {
+            "is_busy": len(in_flight) >= self.max_workers,
+            "queue_depth": self._queue_depth,
+            "queue_capacity": self.max_queue_size,
+            "active_workers": len(in_flight),
+            "max_workers": self.max_workers,
+            "in_flight_users": sorted({job.account_id for job in in_flight}),
+            "processing_time": now - oldest_start if oldest_start else 0
+        }
+
+
+scheduler = LabelScheduler()
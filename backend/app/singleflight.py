@@ -0,0 +1,84 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Coalesce identical /label requests that are in flight at the same time
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time: callers arriving with a key that is
+    already in flight await that call's result instead of starting their own.
+
+    The call runs in its own task, so a caller that goes away does not cancel it
+    for the others; it is cancelled once all of them have gone away. Its context
+    (stage timings, token usage, progress listener) is the first caller's.
+    """
+
+    def __init__(self, enabled: bool = REQUEST_COALESCING_ENABLED):
+        self.enabled = enabled
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> Tuple[Any, bool]:
+        """
+        Await func(*args), or the call already running for key
+        :return: Tuple of (result, coalesced), coalesced is True when another caller's call was reused
+        """
+        if not self.enabled:
+            return await func(*args), False
+
+        task = self._in_flight.get(key)
+        while task is not None:
+            try:
+                result = await self._wait(key, task)
+            except Exception:
+                # The failure may be specific to the first caller (e.g. its account's queue
+                # being full), so retry: join a newer call for the key or make one
+                failed, task = task, self._in_flight.get(key)
+                if task is failed:
+                    task = None
+            else:
+                self.coalesced += 1
+                return result, True
+
+        self.calls += 1
+        task = asyncio.create_task(func(*args))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await self._wait(key, task), False
+
+    async def _wait(self, key: Hashable, task: asyncio.Task) -> Any:
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    # Nobody wants the result anymore, free the worker it would take;
+                    # callers arriving from now on start a new call
+                    task.cancel()
+                    self._forget(key, task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Nobody may be left to await a failed call
+        if task.done() and not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        """Call counts since process start"""
+        total = self.calls + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / total if total else 0.0
+        }
@@ -0,0 +1,279 @@
+"""
+Load test for the labeling API against the mock OpenAI server.
+
+Starts bench.mock_openai and the FastAPI app (on a fresh SQLite database) as
+subprocesses, drives /login, /label, /feedback and /logs-summary at the target
+concurrency and prints a JSON report with latency percentiles, throughput and
+rejection rates per endpoint.
+
+    cd backend
+    python -m bench.loadtest --concurrency 16 --requests 500 --latency-ms 300 --output before.json
+    python -m bench.loadtest --concurrency 16 --requests 500 --app-env MICROBATCH_ENABLED=true
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERS = [("user1", "user123"), ("user2", "user456"), ("user3", "user789"), ("demo", "demo123")]
+ADMIN = ("admin", "admin123")
+
+SAMPLE_TEXTS = [
+    "Responsible for managing a team of analysts covering the technology sector and publishing stock recommendations.",
+    "Led the execution of multiple IPOs and follow-on offerings for technology companies.",
+    "Managed corporate card programs and merchant acquiring relationships for mid-size retailers.",
+    "Structured interest rate swaps and credit-linked notes for institutional clients.",
+    "Built the mobile banking app onboarding flow and chatbot for retail customers.",
+    "Oversaw custody, clearing and settlement operations for asset manager clients.",
+    "Advised private clients and family offices on portfolio allocation.",
+    "Ran treasury cash pooling and liquidity management for corporate clients.",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """Latency and status code samples per endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.label_failures = 0
+
+    def record(self, endpoint: str, status_code: int, seconds: float):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status_code] += 1
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in self.latencies.items():
+            samples = sorted(samples)
+            statuses = self.statuses[endpoint]
+            count = len(samples)
+            ok = sum(n for code, n in statuses.items() if 200 <= code < 300)
+            rejected = statuses.get(429, 0)
+            endpoints[endpoint] = {
+                "count": count,
+                "ok": ok,
+                "rejected": rejected,
+                "errors": count - ok - rejected,
+                "rejection_rate": rejected / count if count else 0.0,
+                "throughput_rps": ok / duration if duration else 0.0,
+                "mean_ms": 1000 * sum(samples) / count if count else None,
+                "p50_ms": 1000 * _percentile(samples, 0.50) if count else None,
+                "p95_ms": 1000 * _percentile(samples, 0.95) if count else None,
+                "p99_ms": 1000 * _percentile(samples, 0.99) if count else None,
+                "status_codes": {str(code): n for code, n in sorted(statuses.items())},
+            }
+        return endpoints
+
+
+async def _timed(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        recorder.record(endpoint, 0, time.perf_counter() - start)
+        return None
+    recorder.record(endpoint, response.status_code, time.perf_counter() - start)
+    return response
+
+
+async def _login(client: httpx.AsyncClient, recorder: Recorder, username: str, password: str) -> dict:
+    response = await _timed(client, recorder, "/login", "POST", "/login",
+                            json={"username": username, "password": password})
+    if response is None or response.status_code != 200:
+        raise RuntimeError(f"Login failed for {username}")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_load(base_url: str, args) -> dict:
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    remaining = {"requests": args.requests}
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        admin_headers = await _login(client, recorder, *ADMIN)
+
+        async def virtual_user(index: int):
+            headers = await _login(client, recorder, *USERS[index % len(USERS)])
+            while remaining["requests"] > 0:
+                remaining["requests"] -= 1
+                sent = args.requests - remaining["requests"]
+                text = rng.choice(SAMPLE_TEXTS)
+                if rng.random() >= args.repeat_ratio:
+                    # A unique suffix keeps the prediction cache out of the measurement
+                    text = f"{text} (case {index}-{sent})"
+                response = await _timed(client, recorder, "/label", "POST", "/label", headers=headers,
+                                        json={"text": text, "model_name": args.model})
+                if response is not None and response.status_code == 200:
+                    result = response.json()
+                    if result.get("predicted_label") is None:
+                        recorder.label_failures += 1
+                    elif rng.random() < args.feedback_ratio:
+                        await _timed(client, recorder, "/feedback", "POST", "/feedback", headers=headers,
+                                     json={"request_id": result["id"], "is_supported": rng.random() < 0.8})
+                elif response is not None and response.status_code == 429:
+                    await asyncio.sleep(min(float(response.headers.get("Retry-After", "1")), args.max_backoff))
+                if args.summary_every and sent % args.summary_every == 0:
+                    await _timed(client, recorder, "/logs-summary", "GET", "/logs-summary", headers=admin_headers)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[virtual_user(i) for i in range(args.concurrency)])
+        duration = time.perf_counter() - start
+
+    endpoints = recorder.report(duration)
+    label_ok = endpoints.get("/label", {}).get("ok", 0)
+    return {
+        "duration_s": duration,
+        "endpoints": endpoints,
+        "label_failures": recorder.label_failures,
+        "label_failure_rate": recorder.label_failures / label_ok if label_ok else 0.0,
+    }
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before {url} came up")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def _stop(process: Optional[subprocess.Popen]):
+    if process is not None and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users sending requests in parallel")
+    parser.add_argument("--requests", type=int, default=200, help="Total /label requests")
+    parser.add_argument("--model", default="gpt-4")
+    parser.add_argument("--feedback-ratio", type=float, default=0.2, help="Fraction of labels that get feedback")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of texts repeated verbatim (cache hits)")
+    parser.add_argument("--summary-every", type=int, default=50, help="Call /logs-summary every N requests, 0 = never")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Mock LLM latency")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock LLM HTTP 500 rate")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Mock LLM HTTP 429 rate")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the app, e.g. LABEL_WORKERS=16 (repeatable)")
+    parser.add_argument("--base-url", help="Benchmark an already running app instead of starting one")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--max-backoff", type=float, default=2.0, help="Longest sleep after a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    mock = app = None
+    workdir = tempfile.mkdtemp(prefix="labeling-bench-")
+    mock_stats = None
+    try:
+        base_url = args.base_url
+        if base_url is None:
+            mock_port, app_port = _free_port(), _free_port()
+            mock = subprocess.Popen(
+                [sys.executable, "-m", "bench.mock_openai", "--port", str(mock_port),
+                 "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                 "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+                 "--seed", str(args.seed)],
+                cwd=BACKEND_DIR
+            )
+            env = {
+                **os.environ,
+                "OPENAI_API_KEY": "bench",
+                "OPENAI_API_BASE": f"http://127.0.0.1:{mock_port}/v1",
+                "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                # The client-side OpenAI rate limits would otherwise dominate the numbers,
+                # pass --app-env OPENAI_RATE_LIMITS=... to benchmark with them
+                "OPENAI_RATE_LIMITS": json.dumps({model: {"rpm": 0, "tpm": 0} for model in ("gpt-4", "gpt-3.5-turbo")}),
+            }
+            for item in args.app_env:
+                key, _, value = item.partition("=")
+                env[key] = value
+            app = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port), "--log-level", "warning"],
+                cwd=BACKEND_DIR, env=env
+            )
+            _wait_until_up(f"http://127.0.0.1:{mock_port}/stats", mock, 60)
+            _wait_until_up(f"http://127.0.0.1:{app_port}/ready", app, 120)
+            base_url = f"http://127.0.0.1:{app_port}"
+
+        result = asyncio.run(run_load(base_url, args))
+        if mock is not None:
+            mock_stats = httpx.get(f"http://127.0.0.1:{mock_port}/stats").json()
+    finally:
+        _stop(app)
+        _stop(mock)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "model": args.model,
+            "feedback_ratio": args.feedback_ratio,
+            "repeat_ratio": args.repeat_ratio,
+            "mock_latency_ms": args.latency_ms,
+            "mock_jitter_ms": args.jitter_ms,
+            "mock_error_rate": args.error_rate,
+            "mock_rate_limit_rate": args.rate_limit_rate,
+            "app_env": args.app_env,
+        },
+        **result,
+        "mock": mock_stats,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Micro-benchmarks for the hot spots of a /label request, no network involved.
+
+- create_config: building the agent configuration (taxonomy guidelines included)
+- dataset: the original temp-CSV dataset construction vs an in-memory frame vs
+  the prompts the warm agent builds today
+- logging: the original commit + refresh + commit per request vs the batched
+  inserts of the log writer
+- parse: autolabel's response parser vs the label matcher on exact, variant
+  and truncated answers
+
+Runs on a throwaway SQLite database and prints a JSON report.
+
+    cd backend
+    python -m bench.microbench --repeat 200 --output micro.json
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+# The app reads its settings at import time, so point it at a scratch database first
+_workdir = tempfile.mkdtemp(prefix="labeling-microbench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import pandas as pd  # noqa: E402
+from autolabel import AutolabelDataset  # noqa: E402
+from langchain.schema import Generation  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+from app.models import RequestLog, engine, create_db_and_tables  # noqa: E402
+from app.labeling import create_config, agent_registry  # noqa: E402
+from app.label_parser import LabelMatcher  # noqa: E402
+from app.log_writer import log_writer, request_ids  # noqa: E402
+
+SAMPLE_TEXT = (
+    "Responsible for managing a team of analysts covering the technology sector. "
+    "Produces detailed research reports on public companies, including financial analysis, "
+    "industry trends, and stock recommendations."
+)
+
+
+def _measure(func: Callable[[], None], repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        func()
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "runs": repeat,
+        "mean_us": 1e6 * statistics.fmean(samples),
+        "p50_us": 1e6 * samples[len(samples) // 2],
+        "p95_us": 1e6 * samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        "min_us": 1e6 * samples[0],
+    }
+
+
+def bench_create_config(repeat: int) -> dict:
+    return {"create_config": _measure(lambda: create_config("gpt-4"), repeat)}
+
+
+def bench_dataset(repeat: int) -> dict:
+    config = create_config("gpt-4")
+    entry = agent_registry.get("gpt-4")
+
+    def temp_csv():
+        # What get_label originally did for every request
+        with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".csv") as tmp:
+            pd.DataFrame({"text": [SAMPLE_TEXT]}).to_csv(tmp.name, index=False, quoting=csv.QUOTE_ALL, escapechar="\\")
+            try:
+                AutolabelDataset(tmp.name, config=config)
+            finally:
+                os.unlink(tmp.name)
+
+    def in_memory_frame():
+        AutolabelDataset(pd.DataFrame({"text": [SAMPLE_TEXT]}), config=config)
+
+    def warm_prompt():
+        entry._build_prompts([SAMPLE_TEXT])
+
+    return {
+        "dataset_temp_csv": _measure(temp_csv, repeat),
+        "dataset_in_memory": _measure(in_memory_frame, repeat),
+        "prompt_warm_agent": _measure(warm_prompt, repeat),
+    }
+
+
+def bench_logging(repeat: int, batch_size: int) -> dict:
+    def new_row(**kwargs) -> RequestLog:
+        return RequestLog(account_id="bench", model_name="gpt-4", input_text=SAMPLE_TEXT, **kwargs)
+
+    def commit_per_request():
+        # The original /label logging: insert, refresh for the id, then update with the result
+        with Session(engine) as session:
+            request_log = new_row()
+            session.add(request_log)
+            session.commit()
+            session.refresh(request_log)
+            request_log.predicted_label = "Research - Equity research"
+            request_log.processing_time = 0.5
+            session.add(request_log)
+            session.commit()
+
+    def batched_insert():
+        rows = [
+            new_row(id=request_ids.next_id(), predicted_label="Research - Equity research", processing_time=0.5)
+            for _ in range(batch_size)
+        ]
+        log_writer._insert(rows)
+
+    per_request = _measure(commit_per_request, repeat)
+    batched = _measure(batched_insert, max(1, repeat // batch_size))
+    per_row = {key: value / batch_size for key, value in batched.items() if key.endswith("_us")}
+    return {
+        "log_commit_per_request": per_request,
+        "log_batched_insert": {**batched, "batch_size": batch_size},
+        "log_batched_insert_per_row": per_row,
+    }
+
+
+def bench_parse(repeat: int) -> dict:
+    entry = agent_registry.get("gpt-4")
+    answers = {
+        "exact": "Research - Equity research",
+        "variant": "  research - equity research.\n",
+        "truncated": "Commercial Banking - Deposit & Cash Management (Treas",
+    }
+    results = {}
+    for name, answer in answers.items():
+        generation = Generation(text=answer)
+        results[f"parse_autolabel_{name}"] = _measure(
+            lambda: entry.agent.task.parse_llm_response(generation, {"text": SAMPLE_TEXT}, ""), repeat
+        )
+        matcher = LabelMatcher(entry.agent.config.labels_list())
+        # A fresh matcher's first lookup, then the memoized one
+        results[f"parse_matcher_{name}"] = _measure(lambda: (matcher._cache.clear(), matcher.match(answer)), repeat)
+        results[f"parse_matcher_{name}_cached"] = _measure(lambda: matcher.match(answer), repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--log-batch-size", type=int, default=100)
+    parser.add_argument("--only", choices=["create_config", "dataset", "logging", "parse"], action="append",
+                        help="Run only the given benchmark (repeatable)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    selected = args.only or ["create_config", "dataset", "logging", "parse"]
+    results = {}
+    if "create_config" in selected:
+        results.update(bench_create_config(args.repeat))
+    if "dataset" in selected:
+        results.update(bench_dataset(args.repeat))
+    if "logging" in selected:
+        results.update(bench_logging(args.repeat, args.log_batch_size))
+    if "parse" in selected:
+        results.update(bench_parse(args.repeat))
+
+    report = {"python": sys.version.split()[0], "results": results}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
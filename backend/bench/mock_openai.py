@@ -0,0 +1,134 @@
+"""
+Fake OpenAI-compatible chat completions server for benchmarks.
+
+Answers with a label chosen deterministically from the prompt text, after a
+configurable latency, and injects server errors and 429s at the given rates.
+When logprobs are requested, the given fraction of prompts is answered with low
+confidence (for model_name "auto" escalation).
+
+    python -m bench.mock_openai --port 8911 --latency-ms 300 --error-rate 0.01 --rate-limit-rate 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.labeling import LABELS, label_codes
+
+# Numbered input lines of a multi-item prompt, e.g. "3: Led the execution of ..."
+_NUMBERED_TEXT = re.compile(r"^(\d+): ", re.MULTILINE)
+# Label list of the "ids" prompt format, which is answered with the label's ID
+_ID_FORMAT_MARKER = "\nL01 | "
+
+
+def _pick_label(text: str) -> str:
+    digest = hashlib.sha256(text.encode()).digest()
+    return LABELS[digest[0] % len(LABELS)]
+
+
+def _answer(prompt: str) -> str:
+    pick = _pick_label
+    if _ID_FORMAT_MARKER in prompt:
+        ids_by_label = {label: code for code, label in label_codes().items()}
+        pick = lambda text: ids_by_label[_pick_label(text)]  # noqa: E731
+    if "\nTexts:\n" in prompt:
+        items = prompt.split("\nTexts:\n", 1)[1]
+        numbers = _NUMBERED_TEXT.findall(items)
+        return "\n".join(f"{number}: {pick(prompt + number)}" for number in numbers)
+    return pick(prompt)
+
+
+def _logprob(prompt: str, low_confidence_rate: float) -> float:
+    # Deterministic per prompt: log(0.5) for the low-confidence share, log(0.99) otherwise
+    digest = hashlib.sha256(prompt.encode()).digest()
+    return math.log(0.5) if digest[1] / 256 < low_confidence_rate else math.log(0.99)
+
+
+def create_app(latency_ms: float = 300, jitter_ms: float = 100, error_rate: float = 0.0,
+               rate_limit_rate: float = 0.0, seed: int = 0, low_confidence_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Mock OpenAI")
+    rng = random.Random(seed)
+    stats = {"requests": 0, "completions": 0, "errors": 0, "rate_limited": 0, "prompt_tokens": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        prompt = body["messages"][-1]["content"]
+
+        if rng.random() < rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                headers={"Retry-After": "1"}
+            )
+
+        await asyncio.sleep(max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Injected server error", "type": "server_error"}}
+            )
+
+        content = _answer(prompt)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = max(1, len(content) // 4)
+        stats["completions"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        choice = {
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }
+        if body.get("logprobs"):
+            choice["logprobs"] = {"content": [{"token": content[:4], "logprob": _logprob(prompt, low_confidence_rate)}]}
+        return {
+            "id": f"chatcmpl-mock-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [choice],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls answered with HTTP 429")
+    parser.add_argument("--low-confidence-rate", type=float, default=0.0,
+                        help="Fraction of prompts answered with low-confidence logprobs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.seed,
+                     args.low_confidence_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
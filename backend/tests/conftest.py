@@ -0,0 +1,87 @@
+"""
+Runs the app against bench.mock_openai on a fresh SQLite database, the same way bench/loadtest.py does.
+The environment must be set before anything under app is imported.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+MOCK_PORT = _free_port()
+MOCK_URL = f"http://127.0.0.1:{MOCK_PORT}"
+_workdir = tempfile.mkdtemp(prefix="labeling-tests-")
+
+os.environ.update({
+    "OPENAI_API_KEY": "test",
+    "OPENAI_API_BASE": f"{MOCK_URL}/v1",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_workdir, 'test.db')}",
+    "OPENAI_RATE_LIMITS": json.dumps({model: {"rpm": 0, "tpm": 0} for model in ("gpt-4", "gpt-3.5-turbo")}),
+    # Rows are committed before /label and /feedback answer, so tests can read them right away
+    "LOG_DURABILITY": "sync",
+    "PASSWORD_HASH_ITERATIONS": "1000",
+})
+
+PASSWORDS = {"admin": "admin123", "user1": "user123", "user2": "user456", "user3": "user789", "demo": "demo123"}
+
+
+@pytest.fixture(scope="session")
+def mock_openai():
+    """bench.mock_openai with a fixed latency, long enough for identical requests to overlap"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_openai", "--port", str(MOCK_PORT),
+         "--latency-ms", "200", "--jitter-ms", "0"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"bench.mock_openai exited with code {process.returncode}")
+        try:
+            httpx.get(f"{MOCK_URL}/stats", timeout=1)
+            break
+        except httpx.HTTPError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+    yield MOCK_URL
+    process.terminate()
+    process.wait(timeout=10)
+
+
+def mock_stats() -> dict:
+    return httpx.get(f"{MOCK_URL}/stats").json()
+
+
+@pytest.fixture(scope="session")
+def client(mock_openai):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        deadline = time.time() + 120
+        while test_client.get("/ready").status_code != 200:
+            assert time.time() < deadline, "App did not become ready"
+            time.sleep(0.2)
+        yield test_client
+
+
+def auth_headers(client, username: str) -> dict:
+    response = client.post("/login", json={"username": username, "password": PASSWORDS[username]})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
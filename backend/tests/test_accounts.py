@@ -0,0 +1,21 @@
+import hashlib
+
+from sqlmodel import Session
+
+from app.accounts import seed_accounts, verify_account
+from app.models import Account, engine
+
+
+def test_seeded_accounts_are_stored_with_pbkdf2(client):
+    with Session(engine) as session:
+        account = session.get(Account, "demo")
+        account.password_hash = hashlib.sha256("demo123".encode()).hexdigest()
+        session.add(account)
+        session.commit()
+
+    seed_accounts()
+    with Session(engine) as session:
+        assert session.get(Account, "demo").password_hash.startswith("pbkdf2_sha256$")
+    assert verify_account("demo", "demo123") == "demo"
+    assert verify_account("demo", "wrong") is None
+    assert verify_account("nobody", "demo123") is None
@@ -0,0 +1,34 @@
+import asyncio
+import uuid
+
+from app import batch
+
+
+def test_concurrent_batches_share_the_chunk_limit(client, monkeypatch):
+    in_flight = []
+    peak = []
+
+    async def label_texts(texts, model_name):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        return [("Research - FI research", None)] * len(texts), 0.01
+
+    monkeypatch.setattr(batch, "label_texts", label_texts)
+    monkeypatch.setattr(batch, "chunk_limiter", batch._ChunkLimiter(concurrency=2))
+
+    async def run_batch(rows: int):
+        texts = [f"Shared limit {uuid.uuid4().hex}" for _ in range(rows)]
+        labeled = 0
+        async for chunk in batch.label_chunks(texts, "gpt-4", "user1", chunk_size=5):
+            # Chunks are started as slots free up, not all at once
+            assert len(asyncio.all_tasks()) <= 3 + 2 * 2
+            labeled += len(chunk)
+        return labeled
+
+    async def run():
+        return await asyncio.gather(run_batch(100), run_batch(60))
+
+    assert asyncio.run(run()) == [100, 60]
+    assert max(peak) == 2
@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+from app.batcher import MicroBatcher
+
+
+def test_batches_are_sent_once_every_worker_is_waiting():
+    batches = []
+
+    async def handler(model_name, texts):
+        batches.append((model_name, texts))
+        return [(text.upper(), None) for text in texts]
+
+    async def run():
+        batcher = MicroBatcher(handler, window_ms=10000, max_items=8, enabled=True, max_waiting=4)
+        start = time.monotonic()
+        results = await asyncio.gather(
+            batcher.label("a", "gpt-4"), batcher.label("b", "gpt-4"),
+            batcher.label("c", "gpt-3.5-turbo"), batcher.label("d", "gpt-4"),
+        )
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(run())
+    assert [label for label, _, _ in results] == ["A", "B", "C", "D"]
+    assert sorted(batches) == [("gpt-3.5-turbo", ["c"]), ("gpt-4", ["a", "b", "d"])]
+    # Sent without waiting out the 10 s window
+    assert elapsed < 1.0
@@ -0,0 +1,48 @@
+from sqlmodel import Session
+
+from app.cache import PredictionCacheStore, cache_key
+from app.models import PredictionCache, engine
+
+
+def _row(text: str, model_name: str = "gpt-4"):
+    with Session(engine) as session:
+        return session.get(PredictionCache, cache_key(text, model_name))
+
+
+def test_hits_are_counted_in_memory_and_flushed(client):
+    cache = PredictionCacheStore(max_entries=10, ttl_seconds=0, enabled=True)
+    cache.put("Cache flush text", "gpt-4", "Research - FI research")
+    for _ in range(3):
+        assert cache.get("  Cache  flush text ", "gpt-4") == "Research - FI research"
+    assert cache.get("Cache flush text", "gpt-3.5-turbo") is None
+    # Nothing is written on the request path
+    assert _row("Cache flush text") is None
+    assert cache.stats()["pending_writes"] == 2
+
+    cache.flush()
+    row = _row("Cache flush text")
+    assert (row.predicted_label, row.hit_count) == ("Research - FI research", 3)
+    assert cache.stats()["pending_writes"] == 0
+
+    cache.get("Cache flush text", "gpt-4")
+    cache.flush()
+    assert _row("Cache flush text").hit_count == 4
+
+
+def test_evictions_are_flushed_and_survive_a_reload(client):
+    cache = PredictionCacheStore(max_entries=2, ttl_seconds=0, enabled=True)
+    cache.put("Evicted first", "gpt-4", "Research - FI research")
+    cache.flush()
+    cache.put("Evicted second", "gpt-4", "Research - FI research")
+    cache.put("Evicted third", "gpt-4", "Research - FI research")
+    # Put and evicted within one interval, never written
+    cache.put("Evicted fourth", "gpt-4", "Research - FI research")
+    cache.get("Evicted third", "gpt-4")
+    cache.flush()
+
+    assert [_row(text) is not None for text in ("Evicted first", "Evicted second", "Evicted third", "Evicted fourth")] \
+        == [False, False, True, True]
+    reloaded = PredictionCacheStore(max_entries=10, ttl_seconds=0, enabled=True)
+    reloaded.load()
+    assert reloaded.get("Evicted fourth", "gpt-4") == "Research - FI research"
+    assert reloaded.get("Evicted first", "gpt-4") is None
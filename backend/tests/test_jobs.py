@@ -0,0 +1,75 @@
+import threading
+import time
+
+from conftest import auth_headers
+
+
+def _wait_for_status(client, headers, job_id: str, statuses, timeout: float = 30) -> dict:
+    deadline = time.time() + timeout
+    while True:
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] in statuses:
+            return job
+        assert time.time() < deadline, job
+        time.sleep(0.1)
+
+
+def test_job_lifecycle(client):
+    headers = auth_headers(client, "user1")
+    texts = [f"Job lifecycle row {i}" for i in range(5)]
+    response = client.post("/jobs", json={"texts": texts}, headers=headers)
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+
+    job = _wait_for_status(client, headers, job_id, ("completed", "failed"))
+    assert job["status"] == "completed"
+    assert (job["completed_rows"], job["failed_rows"], job["progress"]) == (5, 0, 1.0)
+
+    results = client.get(f"/jobs/{job_id}/results", headers=headers).json()
+    assert results["total"] == 5
+    assert [row["input_text"] for row in results["results"]] == texts
+    assert all(row["status"] == "done" and row["request_id"] for row in results["results"])
+
+    assert client.post(f"/jobs/{job_id}/cancel", headers=headers).status_code == 409
+    assert client.get(f"/jobs/{job_id}", headers=auth_headers(client, "user2")).status_code == 403
+
+
+def test_cancel_running_job(client):
+    headers = auth_headers(client, "user1")
+    response = client.post("/jobs", json={"texts": [f"Cancelled row {i}" for i in range(200)]}, headers=headers)
+    job_id = response.json()["job_id"]
+    _wait_for_status(client, headers, job_id, ("running",))
+
+    assert client.post(f"/jobs/{job_id}/cancel", headers=headers).status_code == 200
+    job = client.get(f"/jobs/{job_id}", headers=headers).json()
+    assert job["status"] == "cancelled"
+    assert job["completed_rows"] < 200
+    assert client.post(f"/jobs/{job_id}/cancel", headers=headers).status_code == 409
+
+
+def test_large_job_submission_does_not_block_other_requests(client):
+    from app.jobs import JOB_MAX_ROWS
+
+    headers = auth_headers(client, "user2")
+    texts = [f"Large job row {i} " + "x" * 100 for i in range(JOB_MAX_ROWS)]
+    created = {}
+
+    def submit():
+        created["response"] = client.post("/jobs", json={"texts": texts}, headers=headers)
+
+    submitter = threading.Thread(target=submit)
+    submitter.start()
+    latencies = []
+    while submitter.is_alive():
+        start = time.perf_counter()
+        assert client.get("/").status_code == 200
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    submitter.join()
+
+    response = created["response"]
+    assert response.status_code == 202, response.text
+    assert response.json()["total_rows"] == JOB_MAX_ROWS
+    client.post(f"/jobs/{response.json()['job_id']}/cancel", headers=headers)
+    # Inserting the rows took seconds on the event loop before they were written from a thread
+    assert latencies and max(latencies) < 1.0, (len(latencies), max(latencies, default=None))
@@ -0,0 +1,48 @@
+from app.label_parser import LabelMatcher
+
+LABELS = [
+    "Asset Management - Hedge fund",
+    "Asset Management - Private equity",
+    "Research - Equity research",
+    "Research - FI research",
+    "Private Banking - Equity research",
+]
+
+
+def test_exact_answers_with_lead_ins_and_reasoning_lines():
+    matcher = LabelMatcher(LABELS)
+    assert matcher.match("Label: research - fi research.") == "Research - FI research"
+    assert matcher.match("The answer is: \"Asset Management - Private equity\"") == "Asset Management - Private equity"
+    assert matcher.match("The text is about a fund.\n\nAsset Management - Hedge fund\n") == "Asset Management - Hedge fund"
+    assert matcher.match("") is None
+
+
+def test_short_forms_resolve_only_when_unique():
+    matcher = LabelMatcher(LABELS)
+    assert matcher.match("Hedge fund") == "Asset Management - Hedge fund"
+    assert matcher.match("private equity") == "Asset Management - Private equity"
+    # Short form of two labels
+    assert matcher.match("Equity research") is None
+
+
+def test_answers_cut_off_by_max_tokens():
+    matcher = LabelMatcher(LABELS)
+    assert matcher.match("Asset Management - Hedge f") == "Asset Management - Hedge fund"
+    assert matcher.match("Hedg") == "Asset Management - Hedge fund"
+    # Too short, or a prefix of several labels
+    assert matcher.match("Hed") is None
+    assert matcher.match("Asset Management - ") is None
+    assert matcher.match("Research - ") is None
+
+
+def test_fuzzy_cutoff():
+    assert LabelMatcher(LABELS).match("Research - Equty research") == "Research - Equity research"
+    assert LabelMatcher(LABELS, fuzzy_cutoff=1.0).match("Research - Equty research") is None
+    assert LabelMatcher(LABELS).match("Retail banking") is None
+
+
+def test_codes_match_exactly():
+    matcher = LabelMatcher(LABELS, codes={"L3": "Research - Equity research"})
+    assert matcher.match("L3") == "Research - Equity research"
+    assert matcher.match("l3.") == "Research - Equity research"
+    assert matcher.match("L") is None
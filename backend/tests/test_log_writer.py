@@ -0,0 +1,86 @@
+import asyncio
+
+from sqlmodel import Session, select
+
+from app.log_writer import LogWriter, LogWriteError, request_ids
+from app.models import RequestLog, engine
+from conftest import auth_headers
+
+
+def _request_log(request_id: int, account_id: str) -> RequestLog:
+    return RequestLog(id=request_id, account_id=account_id, model_name="gpt-4", input_text="log writer test",
+                      predicted_label="Research - FI research", processing_time=0.1)
+
+
+def _logged_ids(account_id: str) -> list:
+    with Session(engine) as session:
+        return sorted(session.exec(select(RequestLog.id).where(RequestLog.account_id == account_id)).all())
+
+
+def test_flush_writes_buffered_rows(client):
+    async def run():
+        writer = LogWriter(batch_size=100, flush_interval_ms=60000, durability="buffered")
+        await writer.start()
+        ids = [request_ids.next_id() for _ in range(3)]
+        for request_id in ids:
+            await writer.write(_request_log(request_id, "log-flush"))
+        assert _logged_ids("log-flush") == []
+        await writer.flush()
+        assert _logged_ids("log-flush") == ids
+        await writer.stop()
+        return writer.status()
+
+    status = asyncio.run(run())
+    assert (status["written"], status["dropped"]) == (3, 0)
+
+
+def test_failing_row_is_dropped_alone(client):
+    existing_id = request_ids.next_id()
+    LogWriter()._insert([_request_log(existing_id, "log-drop")])
+
+    async def run():
+        writer = LogWriter(batch_size=100, flush_interval_ms=60000, durability="buffered")
+        await writer.start()
+        ids = [request_ids.next_id() for _ in range(5)]
+        for request_id in ids[:2] + [existing_id] + ids[2:]:
+            await writer.write(_request_log(request_id, "log-drop"))
+        await writer.stop()
+        return ids, writer.status()
+
+    ids, status = asyncio.run(run())
+    # The duplicate id fails every attempt for the whole batch, only it is dropped
+    assert (status["written"], status["dropped"]) == (5, 1)
+    assert _logged_ids("log-drop") == sorted([existing_id] + ids)
+
+
+def test_sync_writer_is_told_its_row_was_dropped(client):
+    existing_id = request_ids.next_id()
+    LogWriter()._insert([_request_log(existing_id, "log-sync-drop")])
+
+    async def run():
+        writer = LogWriter(batch_size=3, flush_interval_ms=60000, durability="sync")
+        await writer.start()
+        ids = [request_ids.next_id() for _ in range(2)]
+        results = await asyncio.gather(
+            *(writer.write(_request_log(request_id, "log-sync-drop")) for request_id in [ids[0], existing_id, ids[1]]),
+            return_exceptions=True
+        )
+        await writer.stop()
+        return ids, results
+
+    ids, results = asyncio.run(run())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], LogWriteError)
+    assert _logged_ids("log-sync-drop") == sorted([existing_id] + ids)
+
+
+def test_label_fails_when_its_row_is_dropped(client, monkeypatch):
+    from app.main import request_ids as main_request_ids
+
+    headers = auth_headers(client, "user1")
+    existing_id = client.post("/label", json={"text": "Dropped row test"}, headers=headers).json()["id"]
+    # A request id that is already taken makes the row's insert fail every time
+    monkeypatch.setattr(main_request_ids, "next_id", lambda: existing_id)
+    response = client.post("/label", json={"text": "Dropped row test"}, headers=headers)
+    assert response.status_code == 500
+    assert "could not be written" in response.json()["detail"]
@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime
+
+from sqlmodel import Session, select, func
+
+from conftest import auth_headers
+
+
+def _totals(account_id: str) -> dict:
+    from app.models import UsageRollup, engine
+
+    columns = ("requests", "errors", "cache_hits", "feedback", "feedback_supported", "feedback_corrected")
+    with Session(engine) as session:
+        row = session.exec(
+            select(*(func.coalesce(func.sum(getattr(UsageRollup, name)), 0) for name in columns))
+            .where(UsageRollup.account_id == account_id)
+        ).one()
+    return dict(zip(columns, row))
+
+
+def test_rollups_match_a_mixed_batch_of_requests_and_feedback(client):
+    headers = auth_headers(client, "user3")
+    before = _totals("user3")
+
+    texts = ["The battery died after two days", "Great support team, thanks", "The battery died after two days"]
+    request_ids = []
+    for text in texts:
+        response = client.post("/label", json={"text": text}, headers=headers)
+        assert response.status_code == 200, response.text
+        request_ids.append(response.json()["id"])
+    for request_id, is_supported, corrected_label in (
+        (request_ids[0], True, None), (request_ids[1], False, "Research - Equity research"), (request_ids[2], True, None)
+    ):
+        response = client.post("/feedback", headers=headers, json={
+            "request_id": request_id, "is_supported": is_supported, "corrected_label": corrected_label
+        })
+        assert response.status_code == 200, response.text
+
+    after = _totals("user3")
+    assert {name: after[name] - before[name] for name in after} == {
+        "requests": 3, "errors": 0, "cache_hits": 1,
+        "feedback": 3, "feedback_supported": 2, "feedback_corrected": 1,
+    }
+
+
+def test_concurrent_writers_add_up_without_conflicts(client):
+    from app.analytics import commit_with_rollups
+    from app.log_writer import request_ids
+    from app.models import RequestLog, engine
+
+    account_id = "rollup-race"
+    timestamp = datetime.utcnow()
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def write():
+        rows = [
+            RequestLog(id=request_ids.next_id(), account_id=account_id, model_name="gpt-4", input_text="text",
+                       predicted_label="Other", timestamp=timestamp, processing_time=0.2)
+            for _ in range(5)
+        ]
+        barrier.wait()
+        try:
+            with Session(engine) as session:
+                session.add_all(rows)
+                commit_with_rollups(session, rows)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert _totals(account_id)["requests"] == 40
+
+
+def test_cache_stats_read_the_logged_totals_from_the_rollups(client):
+    from app.models import RequestLog, engine
+
+    headers = auth_headers(client, "admin")
+    for text in ("Cache stats text", "Cache stats text"):
+        assert client.post("/label", json={"text": text}, headers=headers).status_code == 200
+    stats = client.get("/admin/cache", headers=headers).json()
+    with Session(engine) as session:
+        requests = session.exec(select(func.count(RequestLog.id))).one()
+        cache_hits = session.exec(select(func.count(RequestLog.id)).where(RequestLog.cache_hit == True)).one()
+    assert (stats["logged_requests"], stats["logged_cache_hits"]) == (requests, cache_hits)
+    assert cache_hits >= 1
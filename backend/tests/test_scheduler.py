@@ -0,0 +1,68 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.scheduler import LabelScheduler, QueueFullError
+from conftest import auth_headers
+
+
+def test_accounts_are_served_round_robin():
+    order = []
+
+    async def record(name):
+        order.append(name)
+
+    async def run():
+        scheduler = LabelScheduler(max_workers=1, max_queue_size=10)
+        release = asyncio.Event()
+        blocker = asyncio.create_task(scheduler.submit("blocker", release.wait))
+        await asyncio.sleep(0)
+        submitted = [
+            asyncio.create_task(scheduler.submit(account, record, f"{account}{i}"))
+            for account, count in (("a", 3), ("b", 2), ("c", 1)) for i in range(count)
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(blocker, *submitted)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert order == ["a0", "b0", "c0", "a1", "b1", "a2"]
+
+
+def test_full_queue_is_rejected():
+    async def run():
+        scheduler = LabelScheduler(max_workers=1, max_queue_size=1, max_queue_per_account=5)
+        release = asyncio.Event()
+        running = asyncio.create_task(scheduler.submit("a", release.wait))
+        queued = asyncio.create_task(scheduler.submit("b", release.wait))
+        try:
+            await asyncio.sleep(0.05)
+            with pytest.raises(QueueFullError) as excinfo:
+                # An accepted request would wait for the release, fail on the timeout instead
+                await asyncio.wait_for(scheduler.submit("c", release.wait), 1)
+            assert excinfo.value.retry_after >= 1
+        finally:
+            release.set()
+            await asyncio.gather(running, queued, return_exceptions=True)
+            await scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_label_answers_429_once_the_queue_is_full(client, monkeypatch):
+    from app.main import scheduler
+
+    # Only requests that find an idle worker are accepted
+    monkeypatch.setattr(scheduler, "max_queue_size", 0)
+    headers = auth_headers(client, "user1")
+    texts = [f"Queue test {uuid.uuid4().hex}" for _ in range(scheduler.max_workers * 2)]
+    with ThreadPoolExecutor(len(texts)) as pool:
+        responses = list(pool.map(lambda text: client.post("/label", json={"text": text}, headers=headers), texts))
+
+    rejected = [response for response in responses if response.status_code == 429]
+    assert sorted(response.status_code for response in responses) == [200] * scheduler.max_workers + [429] * len(rejected)
+    assert len(rejected) == scheduler.max_workers
+    assert all(int(response.headers["Retry-After"]) >= 1 for response in rejected)
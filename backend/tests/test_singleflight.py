@@ -0,0 +1,93 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.singleflight import SingleFlight
+from conftest import auth_headers, mock_stats
+
+
+def test_identical_requests_make_one_upstream_call(client, monkeypatch):
+    from app.cache import prediction_cache
+
+    # Only coalescing may save calls here
+    monkeypatch.setattr(prediction_cache, "enabled", False)
+    headers = auth_headers(client, "user2")
+    text = f"Coalescing test {uuid.uuid4().hex}"
+    before = mock_stats()["requests"]
+    with ThreadPoolExecutor(6) as pool:
+        responses = list(pool.map(
+            lambda _: client.post("/label", json={"text": text}, headers=headers), range(6)
+        ))
+
+    assert [response.status_code for response in responses] == [200] * 6
+    assert mock_stats()["requests"] - before == 1
+    assert sorted(response.json()["coalesced"] for response in responses) == [False] + [True] * 5
+    assert len({response.json()["predicted_label"] for response in responses}) == 1
+    assert len({response.json()["id"] for response in responses}) == 6
+
+
+def test_call_is_cancelled_once_every_caller_is_gone():
+    async def run():
+        flights = SingleFlight(enabled=True)
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def call():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.create_task(flights.do("key", call)) for _ in range(2)]
+        await started.wait()
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        # Still wanted by the second caller
+        assert not cancelled.is_set()
+        callers[1].cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flights.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_followers_retry_after_a_failed_call():
+    async def run():
+        flights = SingleFlight(enabled=True)
+        attempts = []
+
+        async def call(caller):
+            attempts.append(caller)
+            await asyncio.sleep(0.01)
+            if len(attempts) == 1:
+                raise RuntimeError("queue full")
+            return "label"
+
+        results = await asyncio.gather(*(flights.do("key", call, i) for i in range(3)), return_exceptions=True)
+        return results, attempts
+
+    results, attempts = asyncio.run(run())
+    assert isinstance(results[0], RuntimeError)
+    # One retry is joined by the remaining follower
+    assert len(attempts) == 2
+    assert sorted(results[1:]) == [("label", False), ("label", True)]
+
+
+def test_disabled_runs_every_call():
+    async def run():
+        flights = SingleFlight(enabled=False)
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "label"
+
+        results = await asyncio.gather(*(flights.do("key", call) for _ in range(3)))
+        return results, calls
+
+    results, calls = asyncio.run(run())
+    assert results == [("label", False)] * 3
+    assert len(calls) == 3
@@ -21,7 +21,7 @@ import {
   ButtonGroup,
 } from '@chakra-ui/react';
 import { useState, useEffect } from 'react';
-import { labelText, submitFeedback, getStatus, getLabels } from '../utils/api';
+import { labelTextStream, submitFeedback, subscribeStatus, getLabels } from '../utils/api';
 import { getAccountId, logout } from '../utils/auth';
 
 interface LabelingInterfaceProps {
@@ -39,25 +39,16 @@ const LabelingInterface = ({ onLogout }) => {
   const [availableLabels, setAvailableLabels] = useState([]);
   const [systemStatus, setSystemStatus] = useState(null);
   const [statusLoading, setStatusLoading] = useState(false);
+  const [progress, setProgress] = useState(null);
   
   const toast = useToast();
   const accountId = getAccountId();
+  const queueFull = systemStatus
+    ? systemStatus.is_busy && systemStatus.queue_depth >= systemStatus.queue_capacity
+    : false;
 
-  // Check system status periodically
-  useEffect(() => {
-    const checkStatus = async () => {
-      try {
-        const status = await getStatus();
-        setSystemStatus(status);
-      } catch (error) {
-        console.error('Failed to fetch status:', error);
-      }
-    };
-
-    checkStatus();
-    const interval = setInterval(checkStatus, 5000); // Check every 5 seconds
-    return () => clearInterval(interval);
-  }, []);
+  // System status is pushed by the server whenever it changes
+  useEffect(() => subscribeStatus(setSystemStatus), []);
 
   // Load available labels
   useEffect(() => {
@@ -89,17 +80,23 @@ const LabelingInterface = ({ onLogout }) => {
     setShowFeedback(false);
 
     try {
-      const response = await labelText({
-        text: inputText,
-        model_name: modelName,
-      });
+      const response = await labelTextStream(
+        {
+          text: inputText,
+          model_name: modelName,
+        },
+        setProgress,
+      );
       setResult(response);
       setShowFeedback(true);
     } catch (error) {
-      if (error.response?.status === 423) {
+      if (error.response?.status === 429) {
+        const retryAfter = error.response.headers?.['retry-after'];
         toast({
           title: 'System Busy',
-          description: error.response.data.detail,
+          description: retryAfter
+            ? `${error.response.data.detail} Retry in about ${retryAfter} seconds.`
+            : error.response.data.detail,
           status: 'warning',
           duration: 5000,
         });
@@ -113,6 +110,7 @@ const LabelingInterface = ({ onLogout }) => {
       }
     } finally {
       setLoading(false);
+      setProgress(null);
     }
   };
 
@@ -180,11 +178,10 @@ const LabelingInterface = ({ onLogout }) => {
                   {systemStatus.is_busy ? 'Busy' : 'Available'}
                 </Badge>
               </HStack>
-              {systemStatus.is_busy && (
-                <Text fontSize="sm" color="gray.600" mt={2}>
-                  User "{systemStatus.current_user}" is currently processing a request...
-                </Text>
-              )}
+              <Text fontSize="sm" color="gray.600" mt={2}>
+                {systemStatus.active_workers}/{systemStatus.max_workers} workers active,{' '}
+                {systemStatus.queue_depth} request(s) queued
+              </Text>
             </CardBody>
           </Card>
         )}
@@ -214,6 +211,13 @@ const LabelingInterface = ({ onLogout }) => {
                     >
                       GPT-3.5 Turbo
                     </Button>
+                    <Button
+                      size="sm"
+                      colorScheme={modelName === 'auto' ? 'blue' : 'gray'}
+                      onClick={() => setModelName('auto')}
+                    >
+                      Auto
+                    </Button>
                   </HStack>
                 </FormControl>
 
@@ -233,10 +237,14 @@ const LabelingInterface = ({ onLogout }) => {
                   size="lg"
                   w="full"
                   isLoading={loading}
-                  loadingText="Processing..."
-                  isDisabled={systemStatus?.is_busy}
+                  loadingText={
+                    progress?.event === 'queued'
+                      ? `Queued, position ${progress.position}...`
+                      : 'Processing...'
+                  }
+                  isDisabled={queueFull}
                 >
-                  {systemStatus?.is_busy ? 'System Busy - Please Wait' : 'Label Text'}
+                  {queueFull ? 'System Busy - Please Wait' : 'Label Text'}
                 </Button>
               </VStack>
             </form>
@@ -261,6 +269,15 @@ const LabelingInterface = ({ onLogout }) => {
                 <Box>
                   <Text fontWeight="medium" mb={2}>Model Used:</Text>
                   <Badge colorScheme="blue">{result.model_name}</Badge>
+                  {result.routed_model && (
+                    <Text fontSize="xs" color="gray.500" mt={1}>
+                      Answered by {result.routed_model}
+                      {result.escalated ? ' (escalated)' : ''}
+                      {result.routing_confidence != null
+                        ? `, confidence ${(result.routing_confidence * 100).toFixed(0)}%`
+                        : ''}
+                    </Text>
+                  )}
                 </Box>
 
                 <Box>
@@ -277,6 +294,13 @@ const LabelingInterface = ({ onLogout }) => {
                 <Box>
                   <Text fontWeight="medium" mb={2}>Processing Time:</Text>
                   <Text fontSize="sm">{result.processing_time.toFixed(2)} seconds</Text>
+                  {result.timings && (
+                    <Text fontSize="xs" color="gray.500" mt={1}>
+                      {Object.entries(result.timings)
+                        .map(([stage, ms]) => `${stage.replace(/_/g, ' ')}: ${ms.toFixed(0)} ms`)
+                        .join(' · ')}
+                    </Text>
+                  )}
                 </Box>
 
                 {result.error_message && (
@@ -33,7 +33,7 @@ export interface LoginResponse {
 
 export interface LabelRequest {
   text: string;
-  model_name: 'gpt-4' | 'gpt-3.5-turbo';
+  model_name: 'gpt-4' | 'gpt-3.5-turbo' | 'auto';
 }
 
 export interface LabelResponse {
@@ -43,6 +43,17 @@ export interface LabelResponse {
   predicted_label: string | null;
   processing_time: number;
   error_message?: string;
+  cache_hit?: boolean;
+  knn_hit?: boolean;
+  routed_model?: string | null;
+  routing_confidence?: number | null;
+  escalated?: boolean;
+  coalesced?: boolean;
+  prompt_tokens?: number | null;
+  completion_tokens?: number | null;
+  // Milliseconds per pipeline stage, from the Server-Timing header (or the /label/stream result event)
+  // when the backend sends one
+  timings?: Record<string, number>;
 }
 
 export interface FeedbackRequest {
@@ -53,19 +64,97 @@ export interface FeedbackRequest {
 
 export interface StatusResponse {
   is_busy: boolean;
-  current_user: string | null;
+  queue_depth: number;
+  queue_capacity: number;
+  active_workers: number;
+  max_workers: number;
+  in_flight_users: string[];
   processing_time: number;
 }
 
+// Progress events of POST /label/stream before the result arrives
+export type LabelProgress =
+  | { event: 'queued'; position: number; queue_depth: number }
+  | { event: 'started'; queue_wait: number };
+
 // API functions
 export const login = async (data: LoginRequest): Promise<LoginResponse> => {
   const response = await api.post('/login', data);
   return response.data;
 };
 
+// "cache_lookup;dur=0.2, llm_call;dur=812.4" -> { cache_lookup: 0.2, llm_call: 812.4 }
+const parseServerTiming = (header?: string): Record<string, number> | undefined => {
+  if (!header) return undefined;
+  const timings: Record<string, number> = {};
+  header.split(',').forEach((entry) => {
+    const [name, ...params] = entry.trim().split(';');
+    const duration = params.find((param) => param.trim().startsWith('dur='));
+    if (name && duration) {
+      timings[name] = parseFloat(duration.trim().slice(4));
+    }
+  });
+  return timings;
+};
+
 export const labelText = async (data: LabelRequest): Promise<LabelResponse> => {
   const response = await api.post('/label', data);
-  return response.data;
+  return { ...response.data, timings: parseServerTiming(response.headers['server-timing']) };
+};
+
+// Errors from the stream in the shape of an axios error, so callers handle both endpoints alike
+const streamError = (status: number, detail: unknown, retryAfter?: number) => ({
+  response: {
+    status,
+    data: { detail },
+    headers: retryAfter ? { 'retry-after': String(retryAfter) } : {},
+  },
+});
+
+export const labelTextStream = async (
+  data: LabelRequest,
+  onProgress: (progress: LabelProgress) => void,
+): Promise<LabelResponse> => {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${API_BASE_URL}/label/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify(data),
+  });
+  if (!response.ok || !response.body) {
+    const body = await response.json().catch(() => ({}));
+    throw streamError(response.status, body.detail);
+  }
+
+  // Server-Sent Events: "event: <name>\ndata: <json>\n\n"
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    let end;
+    while ((end = buffer.indexOf('\n\n')) >= 0) {
+      const message = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      const event = message.match(/^event: (.*)$/m)?.[1];
+      const payload = JSON.parse(message.match(/^data: (.*)$/m)?.[1] ?? '{}');
+      if (event === 'result') {
+        reader.cancel();
+        const { timings, ...result } = payload;
+        return { ...result, timings: timings ?? undefined };
+      }
+      if (event === 'error') {
+        reader.cancel();
+        throw streamError(payload.status_code, payload.detail, payload.retry_after);
+      }
+      onProgress({ event, ...payload } as LabelProgress);
+    }
+  }
+  throw new Error('Label stream ended without a result');
 };
 
 export const submitFeedback = async (data: FeedbackRequest): Promise<{ status: string; message: string }> => {
@@ -78,6 +167,13 @@ export const getStatus = async (): Promise<StatusResponse> => {
   return response.data;
 };
 
+// Pushes of the /status payload whenever it changes; returns a function that unsubscribes
+export const subscribeStatus = (onStatus: (status: StatusResponse) => void): (() => void) => {
+  const source = new EventSource(`${API_BASE_URL}/status/stream`);
+  source.addEventListener('status', (event) => onStatus(JSON.parse((event as MessageEvent).data)));
+  return () => source.close();
+};
+
 export const getLabels = async (): Promise<{ labels: string[] }> => {
   const response = await api.get('/labels');
   return response.data;